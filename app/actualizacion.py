@@ -0,0 +1,317 @@
+import contextlib
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import cuantiles
+import datos
+import historico
+
+# Lock de archivo entre procesos: flock en Unix, msvcrt.locking en Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Las nuevas descargas de Inside Airbnb se dejan en data/ con la fecha del scrape:
+#   data/listings_<ciudad>_<AAAA-MM-DD>.csv (o .csv.gz)
+PATRON_SNAPSHOT = "listings_{ciudad}_*.csv*"
+FECHA_SNAPSHOT = re.compile(r"_(\d{4}-\d{2}-\d{2})\.csv(\.gz)?$")
+
+# Segundos mínimos entre dos comprobaciones de snapshots nuevos
+INTERVALO_COMPROBACION = 60
+
+_ultima_comprobacion = {}
+_lock = threading.Lock()
+
+
+def version_actual(ciudad, data_dir=datos.DATA_DIR):
+    # Fecha del último snapshot aplicado (None si los datos vienen de los notebooks)
+    return datos.leer_version(ciudad, data_dir)
+
+
+def snapshot_mas_reciente(ciudad, data_dir=datos.DATA_DIR):
+    candidatos = []
+    for ruta in glob.glob(os.path.join(data_dir, PATRON_SNAPSHOT.format(ciudad=ciudad))):
+        m = FECHA_SNAPSHOT.search(ruta)
+        if m:
+            candidatos.append((m.group(1), ruta))
+    if not candidatos:
+        return None, None
+    return max(candidatos)
+
+
+def diferencias(actual, nuevo):
+    # Compara por id y last_scraped: devuelve ids quitados y filas nuevas o cambiadas
+    ids_nuevos = nuevo["id"].to_numpy()
+    quitados = actual.loc[~actual["id"].isin(ids_nuevos), "id"]
+    if "last_scraped" in actual.columns and "last_scraped" in nuevo.columns:
+        previo = actual.set_index("id")["last_scraped"].astype(str)
+        scrape_previo = nuevo["id"].map(previo)
+        cambiados = nuevo[scrape_previo.isna() | (scrape_previo != nuevo["last_scraped"].astype(str))]
+    else:
+        cambiados = nuevo
+    return quitados.to_numpy(), cambiados
+
+
+# Pasos de imputación de cada ciudad, en el orden de su notebook de preparación:
+# (columna, claves de grupo o None para el valor global, estadístico). Las
+# ciudades sin notebook propio siguen los pasos de Valencia.
+IMPUTACIONES = {
+    "valencia": [
+        ("price", ("neighbourhood", "room_type"), "mean"),
+        ("price", None, "median"),
+        ("bathrooms", ("property_type", "accommodates"), "mean"),
+        ("bathrooms", None, "median"),
+        ("bedrooms", ("property_type", "accommodates"), "median"),
+        ("bedrooms", None, "median"),
+        ("beds", ("property_type", "accommodates"), "median"),
+        ("beds", None, "median"),
+    ],
+    "madrid": [
+        ("price", ("neighbourhood", "room_type"), "mean"),
+        ("price", ("neighbourhood", "accommodates"), "mean"),
+        ("bathrooms", ("neighbourhood", "room_type"), "mean"),
+    ],
+}
+
+# Columnas de texto cuyos nulos se marcan como "Sin datos", por ciudad
+SIN_DATOS = {
+    "valencia": ["license", "host_is_superhost", "calendar_updated"],
+    "madrid": ["host_is_superhost"],
+}
+
+
+def _a_numero(serie):
+    if serie.dtype == object:
+        serie = serie.str.replace(r"[\$,€]", "", regex=True)
+    return pd.to_numeric(serie, errors="coerce")
+
+
+def estadisticas_imputacion(ciudad, referencia):
+    # Estadísticos de cada paso calculados sobre los datos ya limpios
+    estadisticas = {}
+    for columna, claves, estadistico in IMPUTACIONES.get(ciudad, IMPUTACIONES["valencia"]):
+        if columna not in referencia.columns or (claves and not set(claves) <= set(referencia.columns)):
+            continue
+        if claves is None:
+            estadisticas[(columna, claves, estadistico)] = referencia[columna].agg(estadistico)
+        else:
+            estadisticas[(columna, claves, estadistico)] = referencia.groupby(list(claves))[columna].agg(estadistico)
+    return estadisticas
+
+
+def _imputar(df, ciudad, estadisticas):
+    for columna, claves, estadistico in IMPUTACIONES.get(ciudad, IMPUTACIONES["valencia"]):
+        valor = estadisticas.get((columna, claves, estadistico))
+        if valor is None or columna not in df.columns:
+            continue
+        if claves is not None:
+            valor = df[list(claves)].join(valor.rename("_valor"), on=list(claves))["_valor"]
+        df[columna] = df[columna].fillna(valor)
+
+
+def _ingresos_valencia(df):
+    # Valencia_prep: días alquilados a partir de la disponibilidad e ingresos = precio * días
+    if "availability_365" in df.columns:
+        df["days_rented"] = (365 - df["availability_365"]).clip(lower=0)
+        df["estimated_revenue_l365d"] = (df["price"] * df["days_rented"]).fillna(0)
+    if "beds" in df.columns:
+        df["beds"] = df["beds"].round(0)
+    return df
+
+
+def _ingresos_madrid(df):
+    # Procesamiento_Madrid: se conservan los ingresos de Inside Airbnb y solo los
+    # nulos se estiman con precio * ocupación estimada
+    if "estimated_revenue_l365d" in df.columns:
+        df["estimated_revenue_l365d"] = _a_numero(df["estimated_revenue_l365d"])
+        if "estimated_occupancy_l365d" in df.columns:
+            df["estimated_revenue_l365d"] = df["estimated_revenue_l365d"].fillna(
+                df["price"] * df["estimated_occupancy_l365d"]
+            )
+    if "bedrooms" in df.columns:
+        df["bedrooms"] = df["bedrooms"].fillna(1)
+    if "bathrooms" in df.columns:
+        # Los anuncios sin baños tras imputar se descartan, como en el notebook
+        df = df[df["bathrooms"].notna()]
+    return df
+
+
+# Pasos posteriores a la imputación, por ciudad
+POST_IMPUTACION = {
+    "valencia": _ingresos_valencia,
+    "madrid": _ingresos_madrid,
+}
+
+
+def limpiar(df, referencia, ciudad, estadisticas=None):
+    # Mismos pasos que el notebook de preparación de cada ciudad, aplicados solo
+    # a las filas nuevas o cambiadas y con los estadísticos de los datos ya limpios
+    if estadisticas is None:
+        estadisticas = estadisticas_imputacion(ciudad, referencia)
+    df = df.drop(columns=["neighbourhood", "neighbourhood_group"], errors="ignore")
+    df = df.rename(columns={
+        "neighbourhood_group_cleansed": "neighbourhood_group",
+        "neighbourhood_cleansed": "neighbourhood",
+    })
+    if "city" in referencia.columns and not referencia.empty:
+        df["city"] = referencia["city"].iloc[0]
+    df["price"] = _a_numero(df["price"])
+    for col in ("bedrooms", "bathrooms"):
+        if col in df.columns:
+            df[col] = _a_numero(df[col])
+    if ciudad == "madrid" and "bathrooms_text" in df.columns and "bathrooms" in df.columns:
+        df["bathrooms"] = df["bathrooms"].fillna(df["bathrooms_text"].str.extract(r"(\d+\.?\d*)", expand=False).astype(float))
+
+    _imputar(df, ciudad, estadisticas)
+    for col in SIN_DATOS.get(ciudad, SIN_DATOS["valencia"]):
+        if col in df.columns:
+            df[col] = df[col].fillna("Sin datos")
+    df = POST_IMPUTACION.get(ciudad, _ingresos_valencia)(df)
+
+    # Las columnas que no existen en el snapshot (p. ej. price_per_m2_jun2025)
+    # se heredan de la versión anterior del anuncio cuando la hay
+    columnas = [c for c in referencia.columns if c not in datos.COLUMNAS_DERIVADAS]
+    faltan = [c for c in columnas if c not in df.columns]
+    if faltan:
+        previas = referencia.set_index("id")[faltan]
+        df = df.join(previas, on="id")
+    return df[columnas]
+
+
+def aplicar_snapshot(ciudad, actual, nuevo, version):
+    # Construye la nueva versión de la ciudad a partir de la actual y el snapshot.
+    # Solo se limpian y derivan las filas nuevas o cambiadas; los agregados se
+    # actualizan restando lo que sale y sumando lo que entra.
+    listings = actual["listings"]
+    quitados, cambiados = diferencias(listings, nuevo)
+    quitar = (listings["id"].isin(quitados) | listings["id"].isin(cambiados["id"])).to_numpy()
+    salen = listings[quitar]
+    # Los estadísticos de imputación se calculan una vez y viajan con los agregados
+    estadisticas = actual.get("imputacion") or estadisticas_imputacion(ciudad, listings)
+    entran = datos.derivar_columnas(limpiar(cambiados, listings, ciudad, estadisticas), actual.get("inmobiliario"))
+    entran = entran.reindex(columns=listings.columns)
+
+    resultado = dict(actual)
+    resultado["imputacion"] = estadisticas
+    resultado["listings"] = datos.empalmar_listings(listings, actual["indice_barrios"], quitar, entran)
+    resultado["indice_barrios"] = datos.calcular_indice_barrios(resultado["listings"])
+    resultado["agregados"] = datos.actualizar_acumulado(
+        actual["agregados"], datos.sumas_barrio(salen), datos.sumas_barrio(entran)
+    )
+    resultado["distritos"] = datos.actualizar_distritos(actual["distritos"], entran, resultado["indice_barrios"])
+    resultado["agregados_distrito"] = datos.sumas_distrito(resultado["agregados"], resultado["distritos"])
+    resultado["celdas"] = datos.actualizar_acumulado(
+        actual["celdas"], datos.celdas_mapa(salen), datos.celdas_mapa(entran)
+    )
+    if "sketches" in actual:
+        tocados = pd.concat([salen["neighbourhood"], entran["neighbourhood"]]).dropna().unique()
+        resultado["sketches"] = cuantiles.actualizar_sketches(
+            actual["sketches"], resultado["listings"], resultado["indice_barrios"], tocados
+        )
+    resultado["version"] = version
+    resultado["generacion"] = datos.nueva_generacion()
+    resultado["cambios"] = {"quitados": len(quitados), "nuevos_o_cambiados": len(cambiados)}
+    return resultado, quitados, entran
+
+
+def _guardar(ciudad, resultado, data_dir):
+    # Persiste la versión limpia para que un reinicio no tenga que repetir el diff
+    archivo, _ = datos.FUENTES[ciudad]["listings"]
+    columnas = [c for c in resultado["listings"].columns if c not in datos.COLUMNAS_DERIVADAS]
+    # Se escribe a un temporal y se sustituye de golpe: otro proceso o una
+    # recarga nunca leen un archivo a medio escribir
+    ruta = os.path.join(data_dir, archivo)
+    resultado["listings"][columnas].to_csv(ruta + ".tmp", index=False)
+    os.replace(ruta + ".tmp", ruta)
+    ruta = datos.archivo_version(ciudad, data_dir)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"snapshot": resultado["version"], **resultado["cambios"]}, f)
+    os.replace(ruta + ".tmp", ruta)
+
+
+@contextlib.contextmanager
+def _bloqueo_escritura(ciudad, data_dir):
+    # Lock de archivo entre procesos: el panel y la API (app/api.py) tienen
+    # cada uno su caché y su precarga, pero solo uno a la vez aplica un snapshot
+    # y escribe el CSV limpio, la versión y el histórico
+    with open(os.path.join(data_dir, f"{ciudad}.lock"), "a") as f:
+        _bloquear(f)
+        try:
+            yield
+        finally:
+            _desbloquear(f)
+
+
+def _bloquear(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    # msvcrt bloquea un byte y se rinde tras ~10 s de reintentos: se insiste
+    # hasta conseguirlo, como flock
+    while True:
+        try:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _desbloquear(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _fecha_base(listings):
+    # Fecha del scrape de los datos de los notebooks, si se conserva last_scraped
+    if "last_scraped" in listings.columns and listings["last_scraped"].notna().any():
+        return str(pd.to_datetime(listings["last_scraped"]).max().date())
+    return str(pd.Timestamp.today().date())
+
+
+def refrescar(ciudad, data_dir=datos.DATA_DIR, forzar=False):
+    # Aplica el snapshot más reciente si es posterior a la versión cargada.
+    # Las sesiones en marcha ven la nueva versión en su siguiente interacción.
+    ciudad = ciudad.lower()
+    with _lock:
+        ahora = time.monotonic()
+        if not forzar and ahora - _ultima_comprobacion.get(ciudad, -np.inf) < INTERVALO_COMPROBACION:
+            return False
+        _ultima_comprobacion[ciudad] = ahora
+
+        fecha, ruta = snapshot_mas_reciente(ciudad, data_dir)
+        previo = datos.cargar_ciudad(ciudad, data_dir)
+        if fecha is None or (previo["version"] is not None and fecha <= previo["version"]):
+            return False
+
+        with _bloqueo_escritura(ciudad, data_dir):
+            # Otro proceso puede haber aplicado este snapshot (u otro anterior)
+            # mientras tanto: se parte siempre de lo que hay en disco, y si ya
+            # está aplicado solo se recarga
+            actual = datos.recargar(ciudad, data_dir)
+            version = actual["version"] or version_actual(ciudad, data_dir)
+            if version is not None and fecha <= version:
+                return actual is not previo
+
+            historico_dir = os.path.join(data_dir, "historico")
+            if not historico.fechas(ciudad, historico_dir):
+                historico.guardar_base(ciudad, version or _fecha_base(actual["listings"]), actual, historico_dir)
+
+            nuevo = pd.read_csv(ruta)
+            resultado, quitados, entran = aplicar_snapshot(ciudad, actual, nuevo, fecha)
+            historico.guardar_snapshot(ciudad, fecha, entran, quitados, resultado["agregados"], historico_dir)
+            _guardar(ciudad, resultado, data_dir)
+            datos.publicar(ciudad, resultado, data_dir)
+        return True
@@ -0,0 +1,261 @@
+# Servicio HTTP/JSON local con los mismos agregados que muestra el panel.
+#
+# Uso, desde la raíz del repositorio:
+#
+#     python app/api.py --puerto 8502
+#
+# Rutas:
+#   GET /estado                                si todas las ciudades están cargadas,
+#                                              los errores de las que no y los
+#                                              segundos de lectura de cada archivo
+#   GET /ciudades                              ciudades disponibles
+#   GET /ciudades/<ciudad>                     resumen de la ciudad
+#   GET /ciudades/<ciudad>/barrios             medias por barrio
+#   GET /ciudades/<ciudad>/barrios/<barrio>    medias de un barrio
+#   GET /ciudades/<ciudad>/distritos           medias por distrito
+#   GET /ciudades/<ciudad>/distritos/<d>       medias del distrito y de sus barrios
+#   GET /ciudades/<ciudad>/screener?...        barrios que cumplen unos filtros
+#   GET /ciudades/<ciudad>/cuantiles/<m>?barrios=a,b
+#                                              cuartiles por barrio y de la selección
+#   GET /ciudades/<ciudad>/export.csv          medias por barrio en CSV
+#
+# Las respuestas se calculan a partir de los agregados por barrio ya
+# precalculados en datos.py y se guardan serializadas (y comprimidas) hasta que
+# cambia la versión de los datos. Soporta ETag/If-None-Match y gzip. Al
+# arrancar se precargan todas las ciudades en segundo plano (precarga.py).
+# Puede correr a la vez que el panel: cada snapshot lo aplica y lo escribe en
+# disco un solo proceso (actualizacion.refrescar) y el otro lo recarga.
+import argparse
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+
+import cuantiles
+import datos
+import precarga
+
+# Filtros del screener: parámetro -> (métrica, comparación)
+FILTROS_SCREENER = {
+    "min_roi": ("Net ROI (%)", np.greater_equal),
+    "max_precio": ("price", np.less_equal),
+    "min_precio": ("price", np.greater_equal),
+    "min_rentabilidad": ("estimated_revenue_l365d", np.greater_equal),
+    "max_precio_m2": ("price_per_m2_jun2025", np.less_equal),
+    "min_anuncios": ("n_anuncios", np.greater_equal),
+    "max_anuncios": ("n_anuncios", np.less_equal),
+}
+
+MAX_RESPUESTAS_CACHEADAS = 1024
+
+
+class ErrorApi(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+_respuestas = OrderedDict()
+_lock = threading.Lock()
+
+
+def _medias(datos_ciudad):
+    return datos.medias(datos_ciudad["agregados"]).rename_axis("neighbourhood").reset_index()
+
+
+def _json(objeto):
+    return json.dumps(objeto, ensure_ascii=False, allow_nan=False).encode("utf-8")
+
+
+def _registros(df):
+    # to_json convierte NaN en null, que es JSON válido
+    return df.to_json(orient="records", force_ascii=False).encode("utf-8")
+
+
+def _cargar(ciudad):
+    if ciudad not in datos.FUENTES:
+        raise ErrorApi(404, f"Ciudad desconocida: {ciudad}")
+    return datos.cargar_ciudad(ciudad)
+
+
+def resumen_ciudad(ciudad, datos_ciudad):
+    agregados = datos_ciudad["agregados"]
+    resumen = {"ciudad": ciudad, "version": datos_ciudad.get("version"), "n_barrios": len(agregados)}
+    resumen["n_anuncios"] = int(agregados["n_anuncios"].sum())
+    for col in agregados.columns:
+        if col.endswith("_suma"):
+            metrica = col[: -len("_suma")]
+            n = agregados[f"{metrica}_n"].sum()
+            resumen[metrica] = float(agregados[col].sum() / n) if n else None
+    return resumen
+
+
+def screener(medias, params):
+    filtro = np.ones(len(medias), dtype=bool)
+    for parametro, (metrica, comparar) in FILTROS_SCREENER.items():
+        if parametro not in params:
+            continue
+        if metrica not in medias.columns:
+            raise ErrorApi(400, f"La métrica {metrica} no existe en esta ciudad")
+        try:
+            valor = float(params[parametro])
+        except ValueError:
+            raise ErrorApi(400, f"Valor no numérico para {parametro}")
+        filtro &= comparar(medias[metrica].to_numpy(), valor)
+    resultado = medias[filtro]
+    orden = params.get("orden")
+    if orden is not None:
+        if orden.lstrip("-") not in resultado.columns:
+            raise ErrorApi(400, f"No se puede ordenar por {orden}")
+        resultado = resultado.sort_values(orden.lstrip("-"), ascending=not orden.startswith("-"))
+    if "limite" in params:
+        try:
+            resultado = resultado.head(int(params["limite"]))
+        except ValueError:
+            raise ErrorApi(400, "Valor no numérico para limite")
+    return resultado
+
+
+def construir_respuesta(ruta, params):
+    # Devuelve (content_type, cuerpo) para una ruta; lanza ErrorApi si no existe
+    partes = [unquote(p) for p in ruta.strip("/").split("/") if p]
+    if partes == ["ciudades"]:
+        return "application/json", _json({"ciudades": list(datos.FUENTES)})
+    if len(partes) < 2 or partes[0] != "ciudades":
+        raise ErrorApi(404, "Ruta no encontrada")
+
+    ciudad = partes[1].lower()
+    datos_ciudad = _cargar(ciudad)
+    if len(partes) == 2:
+        return "application/json", _json(resumen_ciudad(ciudad, datos_ciudad))
+
+    medias = _medias(datos_ciudad)
+    if partes[2] == "barrios" and len(partes) == 3:
+        return "application/json", _registros(medias)
+    if partes[2] == "barrios" and len(partes) == 4:
+        barrio = medias[medias["neighbourhood"] == partes[3]]
+        if barrio.empty:
+            raise ErrorApi(404, f"Barrio desconocido: {partes[3]}")
+        return "application/json", _registros(barrio)[1:-1]
+    if partes[2] == "distritos":
+        medias_distrito = datos.medias(datos_ciudad["agregados_distrito"]).reset_index()
+        if len(partes) == 3:
+            return "application/json", _registros(medias_distrito)
+        if len(partes) == 4:
+            distrito = medias_distrito[medias_distrito["neighbourhood_group"] == partes[3]]
+            if distrito.empty:
+                raise ErrorApi(404, f"Distrito desconocido: {partes[3]}")
+            barrios = medias[medias["neighbourhood"].isin(datos_ciudad["distritos"][partes[3]])]
+            cuerpo = b'{"distrito":' + _registros(distrito)[1:-1] + b',"barrios":' + _registros(barrios) + b"}"
+            return "application/json", cuerpo
+    if partes[2] == "screener" and len(partes) == 3:
+        return "application/json", _registros(screener(medias, params))
+    if partes[2] == "cuantiles" and len(partes) == 4:
+        sketches = datos_ciudad.get("sketches", {})
+        if partes[3] not in sketches:
+            raise ErrorApi(404, f"Sin cuantiles para la métrica {partes[3]}")
+        barrios = params["barrios"].split(",") if params.get("barrios") else list(sketches[partes[3]])
+        resumenes = cuantiles.resumenes_barrios(sketches, partes[3], barrios)
+        conjunto = cuantiles.resumen_seleccion(sketches, partes[3], barrios)
+        cuerpo = b'{"seleccion":' + _json(conjunto) + b',"barrios":' + _registros(resumenes) + b"}"
+        return "application/json", cuerpo
+    if partes[2] == "export.csv" and len(partes) == 3:
+        return "text/csv; charset=utf-8", medias.to_csv(index=False).encode("utf-8")
+    raise ErrorApi(404, "Ruta no encontrada")
+
+
+def respuesta(ruta, consulta):
+    # Respuesta cacheada por ruta y versión de los datos: (content_type, cuerpo, gzip, etag)
+    params = {k: v[-1] for k, v in parse_qs(consulta).items()}
+    partes = ruta.strip("/").split("/")
+    if partes == ["estado"]:
+        # Sin caché: cambia mientras avanza la precarga
+        cuerpo = _json({
+            "listo": precarga.lista(),
+            "ciudades": precarga.estado(),
+            "errores": precarga.errores(),
+            "tiempos_carga": datos.tiempos_carga(),
+        })
+        return "application/json", cuerpo, gzip.compress(cuerpo), '"' + hashlib.sha1(cuerpo).hexdigest() + '"'
+    version = None
+    if len(partes) >= 2 and partes[1].lower() in datos.FUENTES:
+        version = _cargar(partes[1].lower())["generacion"]
+    clave = (ruta, tuple(sorted(params.items())), version)
+    with _lock:
+        if clave in _respuestas:
+            _respuestas.move_to_end(clave)
+            return _respuestas[clave]
+
+    content_type, cuerpo = construir_respuesta(ruta, params)
+    etag = '"' + hashlib.sha1(cuerpo).hexdigest() + '"'
+    resultado = (content_type, cuerpo, gzip.compress(cuerpo, compresslevel=6), etag)
+    with _lock:
+        _respuestas[clave] = resultado
+        while len(_respuestas) > MAX_RESPUESTAS_CACHEADAS:
+            _respuestas.popitem(last=False)
+    return resultado
+
+
+class Manejador(BaseHTTPRequestHandler):
+    # HTTP/1.1 para mantener la conexión abierta entre peticiones
+    protocol_version = "HTTP/1.1"
+    # TCP_NODELAY: cabeceras y cuerpo van en escrituras separadas y, con Nagle y
+    # el ACK retardado, cada respuesta en keep-alive esperaría ~40 ms
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            content_type, cuerpo, comprimido, etag = respuesta(url.path, url.query)
+        except ErrorApi as e:
+            self._enviar(e.estado, "application/json", _json({"error": str(e)}))
+            return
+        except Exception as e:
+            self._enviar(500, "application/json", _json({"error": f"Error al cargar los datos: {e}"}))
+            return
+
+        if etag in [v.strip() for v in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        cabeceras = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            cabeceras["Content-Encoding"] = "gzip"
+            cuerpo = comprimido
+        self._enviar(200, content_type, cuerpo, cabeceras)
+
+    def _enviar(self, estado, content_type, cuerpo, cabeceras=None):
+        self.send_response(estado)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        # Sin log por petición: a cientos de peticiones por segundo solo añade ruido
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API JSON local con los agregados por barrio.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8502)
+    args = parser.parse_args(argv)
+    precarga.iniciar(datos.FUENTES, figuras=False)
+    servidor = ThreadingHTTPServer((args.host, args.puerto), Manejador)
+    print(f"API escuchando en http://{args.host}:{args.puerto}/ciudades")
+    servidor.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
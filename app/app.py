@@ -1,11 +1,14 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import plotly.express as px
-import matplotlib.pyplot as plt
-import seaborn as sns
+from matplotlib.figure import Figure
 import traceback
 
+import actualizacion
+import datos
+import geometria
+import graficos
+import historico
+import precarga
+
 st.set_page_config(
     page_title="Panel de Análisis de mercado inmobiliario (AirBnb)",
     page_icon="🏠📊",
@@ -18,75 +21,77 @@ Este panel te permite explorar datos del mercado inmobiliario en Valencia, Mála
 Utiliza los filtros y selectores en la barra lateral para personalizar tu análisis.
 """)
 
-@st.cache_data(ttl=3600)
-def load_data():
+def load_data(ciudad):
+    # Los datos se cargan una sola vez por proceso y se comparten entre sesiones
     try:
-        df_valencia = pd.read_csv('data/Valencia_limpio.csv')
-        df_inmobiliario = pd.read_csv("data/valencia_vivienda_limpio.csv")
-        df_delincuencia = pd.read_csv("data/crimenValencia.csv", sep=';')
-        df_barcelona = pd.read_csv("data/barcelona_limpio_completo.csv")
-        df_barcelona_inversores = pd.read_csv("data/barcelona_inversores.csv")
-        return df_valencia, df_inmobiliario, df_delincuencia,df_barcelona, df_barcelona_inversores
+        return datos.cargar_ciudad(ciudad)
     except Exception as e:
         st.error(f"Error al cargar los datos: {e}")
         st.text(traceback.format_exc())
-        return None, None, None
+        return None
+
+# Filtro por ciudad
+ciudades = ['Valencia', 'Malaga', 'Madrid', 'Barcelona']
+
+# Carga y figuras por defecto de todas las ciudades en segundo plano (una vez por proceso)
+precarga.iniciar(ciudades)
+if "pendiente" in precarga.estado().values():
+    st.sidebar.info("Precargando datos de todas las ciudades en segundo plano…")
+for ciudad_error, error in precarga.errores().items():
+    st.sidebar.warning(f"No se pudieron precargar los datos de {ciudad_error.capitalize()}: {error}")
+
+datos_valencia = load_data('valencia')
+if datos_valencia is None:
+    st.stop()
+df_valencia = datos_valencia['listings']
+barrios_valencia = sorted(datos_valencia['indice_barrios'])
+df_inmobiliario = datos_valencia['inmobiliario']
+df_delincuencia = datos_valencia['delincuencia']
 
-df_valencia, df_inmobiliario, df_delincuencia,df_barcelona, df_barcelona_inversores = load_data()
+st.sidebar.header("Filtros")
 
-# Preprocesamiento básico y filtros
-if df_valencia is not None and df_inmobiliario is not None:
-    if 'price' in df_valencia.columns:
-        df_valencia['price'] = df_valencia['price'].astype(float)
-    if 'precio' in df_inmobiliario.columns:
-        precio_m2_valencia = df_inmobiliario['precio'].mean()
+
+def filtro_barrios(datos_ciudad):
+    # Filtro jerárquico: distritos completos y, dentro de ellos, barrios concretos.
+    # Sin barrios marcados se toman todos los de los distritos seleccionados.
+    distritos = sorted(datos_ciudad['distritos'])
+    if distritos:
+        selected_distritos = st.sidebar.multiselect("Selecciona distritos", options=distritos, default=distritos)
+        opciones = datos.barrios_de(datos_ciudad, selected_distritos)
     else:
-        precio_m2_valencia = 2000  # fallback
-    average_m2 = 70
-    df_valencia['annual_income'] = df_valencia['price'] * df_valencia['days_rented']
-    df_valencia['estimated_property_value'] = precio_m2_valencia * average_m2
-    df_valencia['ROI (%)'] = (df_valencia['annual_income'] / df_valencia['estimated_property_value']) * 100
-    gastos_anuales = 3000
-    df_valencia['net_annual_income'] = df_valencia['annual_income'] - gastos_anuales
-    df_valencia['Net ROI (%)'] = (df_valencia['net_annual_income'] / df_valencia['estimated_property_value']) * 100
-
-    st.sidebar.header("Filtros")
-
-    
-    # Filtro por ciudad
-ciudades = ['Valencia', 'Malaga', 'Madrid', 'Barcelona']
+        opciones = sorted(datos_ciudad['indice_barrios'])
+    marcados = st.sidebar.multiselect(
+        "Selecciona barrios", options=opciones, placeholder="Todos los barrios de los distritos seleccionados"
+    )
+    return marcados or opciones
+
 
 if 'city' in df_valencia.columns:
     ciudad_seleccionada = st.sidebar.selectbox("Selecciona ciudad", ciudades)
 
-    # Selecciona el dataframe según la ciudad
-    if ciudad_seleccionada.lower() == 'valencia':
-        df_ciudad = df_valencia
-    elif ciudad_seleccionada.lower() == 'barcelona':
-        df_ciudad = df_barcelona
-    elif ciudad_seleccionada.lower() == 'malaga':
+    # Selecciona los datos según la ciudad
+    if ciudad_seleccionada.lower() in ('valencia', 'barcelona', 'malaga', 'madrid'):
+        # Aplica de forma incremental un snapshot nuevo de Inside Airbnb si lo hay
+        # (con la precarga en marcha ya lo hace el hilo en segundo plano)
+        if not precarga.en_marcha():
+            try:
+                actualizacion.refrescar(ciudad_seleccionada)
+            except Exception as e:
+                st.sidebar.warning(f"No se pudo aplicar el último snapshot: {e}")
         try:
-            df_malaga = pd.read_csv("../data/malaga_limpio.csv")
+            datos_ciudad = datos.cargar_ciudad(ciudad_seleccionada)
         except Exception as e:
-            st.warning("No se pudo cargar el dataset de Málaga.")
+            st.warning(f"No se pudo cargar el dataset de {ciudad_seleccionada}.")
             st.stop()
-        df_ciudad = df_malaga
-    elif ciudad_seleccionada.lower() == 'madrid':
-        try:
-            df_madrid = pd.read_csv("../data/madrid_limpio.csv")
-        except Exception as e:
-            st.warning("No se pudo cargar el dataset de Madrid.")
-            st.stop()
-        df_ciudad = df_madrid
     else:
         st.warning("Ciudad no reconocida.")
         st.stop()
+    df_ciudad = datos_ciudad['listings']
 
     # Filtro por barrios
     if 'neighbourhood' in df_ciudad.columns:
-        barrios = sorted(df_ciudad['neighbourhood'].dropna().unique())
-        selected_barrios = st.sidebar.multiselect("Selecciona barrios", options=barrios, default=barrios)
-        df_ciudad = df_ciudad[df_ciudad['neighbourhood'].isin(selected_barrios)]
+        selected_barrios = filtro_barrios(datos_ciudad)
+        df_ciudad = datos.vista_barrios(datos_ciudad, selected_barrios)
         if df_ciudad.empty:
             st.warning("No hay datos para los barrios seleccionados en la ciudad.")
             st.stop()
@@ -96,9 +101,12 @@ if 'city' in df_valencia.columns:
 
 else:
     st.sidebar.warning("No se encontró la columna 'city' en los datos. Mostrando todos los datos.")
-    barrios = sorted(df_valencia['neighbourhood'].dropna().unique())
-    selected_barrios = st.sidebar.multiselect("Selecciona barrios", options=barrios, default=barrios)
-    df_valencia = df_valencia[df_valencia['neighbourhood'].isin(selected_barrios)]
+    ciudad_seleccionada = 'Valencia'
+    datos_ciudad = datos_valencia
+    selected_barrios = filtro_barrios(datos_valencia)
+    df_valencia = datos.vista_barrios(datos_valencia, selected_barrios)
+    barrios_valencia = selected_barrios
+    df_ciudad = df_valencia
     if df_valencia.empty:
         st.warning("No hay datos para los barrios seleccionados.")
         st.stop()
@@ -157,6 +165,24 @@ for i, tab in enumerate(main_tabs):
       
 
 
+def mostrar(fig, mensaje):
+    # Muestra una figura de graficos.py o el mensaje si no hay datos
+    if fig is None:
+        st.info(mensaje)
+    elif isinstance(fig, bytes):
+        st.image(fig)
+    elif isinstance(fig, Figure):
+        st.pyplot(fig)
+    else:
+        st.plotly_chart(fig, use_container_width=True)
+
+
+def figura(titulo, df, construir, datos_figura=None):
+    # Con la vista por defecto se usa la figura ya precalculada (precarga.py);
+    # el título es el de graficos.secciones_ciudad
+    return precarga.figura(ciudad_actual, datos_figura or datos_ciudad, titulo, df, construir)
+
+
 # ------------------ Pestaña 1: Resumen General ------------------
 if len(main_tabs) > 0:
     with main_tabs[0]:
@@ -170,18 +196,7 @@ if len(main_tabs) > 0:
 
             # KDE ROI Bruto y Neto
             st.markdown("#### Distribución de ROI Bruto y Neto (%)")
-            if len(df_ciudad) > 1:
-                fig, ax = plt.subplots(figsize=(10, 5))
-                sns.kdeplot(df_ciudad['ROI (%)'], fill=True, label='ROI Bruto (%)', color='skyblue', bw_adjust=0.7, clip=(0, 50), ax=ax)
-                sns.kdeplot(df_ciudad['Net ROI (%)'], fill=True, label='ROI Neto (%)', color='orange', bw_adjust=0.7, clip=(0, 50), ax=ax)
-                ax.set_title('Distribución de ROI Bruto y Neto')
-                ax.set_xlabel('ROI (%)')
-                ax.set_ylabel('Densidad')
-                ax.set_xlim(0, 50)
-                ax.legend()
-                st.pyplot(fig)
-            else:
-                st.info("No hay suficientes datos para mostrar la distribución de ROI.")
+            mostrar(figura("Distribución de ROI Bruto y Neto (%)", df_ciudad, lambda: graficos.kde_roi(df_ciudad)), "No hay suficientes datos para mostrar la distribución de ROI.")
 
         elif ciudad_actual == "barcelona":
             st.info("Si la ciudad es Barcelona añadir código aquí")
@@ -200,15 +215,7 @@ if len(main_tabs) > 0:
 
             # Distribución de rentabilidad estimada
             st.markdown("#### Distribución de Rentabilidad Estimada (€ / año)")
-            if len(df_ciudad) > 1:
-                fig, ax = plt.subplots(figsize=(10, 5))
-                sns.kdeplot(df_ciudad['estimated_revenue_l365d'], fill=True, color='skyblue', bw_adjust=0.7, ax=ax)
-                ax.set_title('Distribución de Rentabilidad Estimada')
-                ax.set_xlabel('Rentabilidad (€)')
-                ax.set_ylabel('Densidad')
-                st.pyplot(fig)
-            else:
-                st.info("No hay suficientes datos para mostrar la distribución de rentabilidad.")
+            mostrar(figura("Distribución de Rentabilidad Estimada (€ / año)", df_ciudad, lambda: graficos.kde_rentabilidad(df_ciudad)), "No hay suficientes datos para mostrar la distribución de rentabilidad.")
 
         else:
             st.info("No hay datos para mostrar en esta pestaña.")
@@ -220,49 +227,14 @@ else:
 with main_tabs[1]:
     if ciudad_actual.lower() == "valencia":
         st.subheader("Precios de Vivienda por Barrio")
-    
-        if 'precio' in df_inmobiliario.columns:
-            barrio_caros = df_inmobiliario.groupby('neighbourhood')['precio'].mean().reset_index()
-            barrio_caros = barrio_caros.sort_values(by='precio', ascending=False).head(15)
-            if not barrio_caros.empty:
-                fig_precio = px.bar(
-                    barrio_caros,
-                    x='precio',
-                    y='neighbourhood',
-                    orientation='h',
-                    labels={'precio': 'Precio medio m2 de compra (€)', 'neighbourhood': 'Barrio'},
-                    title='Top 15 barrios más caros por precio medio m2 de compra'
-                )
-                st.plotly_chart(fig_precio, use_container_width=True)
-            else:
-                st.info("No hay datos de precios de vivienda para mostrar.")
-        else:
-            st.info("No hay datos de precios de vivienda para mostrar.")
+        mostrar(figura("Precios de Vivienda por Barrio", None, lambda: graficos.precio_vivienda_barrio(df_inmobiliario), datos_valencia), "No hay datos de precios de vivienda para mostrar.")
     elif ciudad_actual.lower() == "barcelona":
         st.info("Si la ciudad es barcelona añadir codigo aqui")
     elif ciudad_actual.lower() == "malaga":
         st.info("Si la ciudad es malaga añadir codigo aqui")
     elif ciudad_actual.lower() == "madrid":
         st.subheader("🏠 Precios de Vivienda por Barrio en Madrid")
-            
-            if 'price_per_m2_jun2025' in df_ciudad.columns:
-                barrio_caros = df_ciudad.groupby('neighbourhood')['price_per_m2_jun2025'].mean().reset_index()
-                barrio_caros = barrio_caros.sort_values(by='price_per_m2_jun2025', ascending=False).head(15)
-                if not barrio_caros.empty:
-                    fig_precio = px.bar(
-                        barrio_caros,
-                        x='price_per_m2_jun2025',
-                        y='neighbourhood',
-                        orientation='h',
-                        labels={'price_per_m2_jun2025': 'Precio medio €/m²', 'neighbourhood': 'Barrio'},
-                        title='Top 15 barrios más caros por precio medio €/m²'
-                    )
-                    st.plotly_chart(fig_precio, use_container_width=True)
-                else:
-                    st.info("No hay datos de precios de vivienda para mostrar.")
-            else:
-                st.info("No hay datos de precios de vivienda para mostrar.")
-
+        mostrar(figura("Precios de Vivienda por Barrio en Madrid", df_ciudad, lambda: graficos.precio_m2_barrio(df_ciudad)), "No hay datos de precios de vivienda para mostrar.")
     else:
         st.info("No hay datos para mostrar en esta pestaña.")
 
@@ -273,35 +245,9 @@ if len(main_tabs) > 2:
             st.subheader("Rentabilidad por Barrio")
 
             if not df_ciudad.empty:
-                # ROI neto por barrio
-                roi_barrio = df_ciudad.groupby('neighbourhood')['Net ROI (%)'].mean().sort_values(ascending=False).head(15)
-                if not roi_barrio.empty:
-                    fig_roi = px.bar(
-                        roi_barrio,
-                        x=roi_barrio.values,
-                        y=roi_barrio.index,
-                        orientation='h',
-                        labels={'x': 'ROI Neto (%)', 'y': 'Barrio'},
-                        title='Top 15 barrios por ROI Neto (%)'
-                    )
-                    st.plotly_chart(fig_roi, use_container_width=True)
-                else:
-                    st.info("No hay datos de ROI Neto para mostrar.")
-
-                # ROI bruto por barrio
-                roi_barrio_bruto = df_ciudad.groupby('neighbourhood')['ROI (%)'].mean().sort_values(ascending=False).head(15)
-                if not roi_barrio_bruto.empty:
-                    fig_roi_bruto = px.bar(
-                        roi_barrio_bruto,
-                        x=roi_barrio_bruto.values,
-                        y=roi_barrio_bruto.index,
-                        orientation='h',
-                        labels={'x': 'ROI Bruto (%)', 'y': 'Barrio'},
-                        title='Top 15 barrios por ROI Bruto (%)'
-                    )
-                    st.plotly_chart(fig_roi_bruto, use_container_width=True)
-                else:
-                    st.info("No hay datos de ROI Bruto para mostrar.")
+                # ROI neto y bruto por barrio
+                mostrar(figura("ROI Neto por barrio", df_ciudad, lambda: graficos.roi_neto_barrio(df_ciudad)), "No hay datos de ROI Neto para mostrar.")
+                mostrar(figura("ROI Bruto por barrio", df_ciudad, lambda: graficos.roi_bruto_barrio(df_ciudad)), "No hay datos de ROI Bruto para mostrar.")
             else:
                 st.info("No hay datos para mostrar en esta pestaña.")
 
@@ -315,19 +261,7 @@ if len(main_tabs) > 2:
             st.subheader("💸 Rentabilidad por Barrio en Madrid")
 
             if not df_ciudad.empty:
-                rentabilidad_barrio = df_ciudad.groupby('neighbourhood')['estimated_revenue_l365d'].mean().sort_values(ascending=False).head(15)
-                if not rentabilidad_barrio.empty:
-                    fig_rentabilidad = px.bar(
-                        rentabilidad_barrio,
-                        x=rentabilidad_barrio.values,
-                        y=rentabilidad_barrio.index,
-                        orientation='h',
-                        labels={'x': 'Rentabilidad Estimada (€)', 'y': 'Barrio'},
-                        title='Top 15 barrios por Rentabilidad Estimada (€)'
-                    )
-                    st.plotly_chart(fig_rentabilidad, use_container_width=True)
-                else:
-                    st.info("No hay datos de rentabilidad estimada para mostrar.")
+                mostrar(figura("Rentabilidad por Barrio en Madrid", df_ciudad, lambda: graficos.rentabilidad_barrio(df_ciudad)), "No hay datos de rentabilidad estimada para mostrar.")
             else:
                 st.info("No hay datos para mostrar en esta pestaña.")
 
@@ -337,46 +271,82 @@ else:
      st.warning("No hay pestañas disponibles para mostrar contenido.")
 
 
+# ------------------ Resumen por distrito con detalle por barrio ------------------
+if len(main_tabs) > 2 and not datos_ciudad['agregados_distrito'].empty:
+    with main_tabs[2]:
+        st.markdown("#### Resumen por distrito")
+        medias_distrito = datos.medias(datos_ciudad['agregados_distrito']).reset_index()
+        mostrar(graficos.resumen_distritos(medias_distrito), "No hay datos por distrito para mostrar.")
+        st.dataframe(medias_distrito, use_container_width=True, hide_index=True)
+
+        distrito = st.selectbox("Ver barrios del distrito", options=medias_distrito['neighbourhood_group'], key="detalle_distrito")
+        medias_detalle = datos.medias(datos_ciudad['agregados']).reset_index()
+        medias_detalle = medias_detalle[medias_detalle['neighbourhood'].isin(datos_ciudad['distritos'].get(distrito, []))]
+        st.dataframe(medias_detalle, use_container_width=True, hide_index=True)
+
+
+# ------------------ Mapa de barrios (geometría simplificada) ------------------
+if len(main_tabs) > 2 and ciudad_actual in geometria.GEOJSON_CIUDAD:
+    with main_tabs[2]:
+        st.markdown("#### Mapa por barrio")
+        medias_barrio = datos.medias(datos_ciudad['agregados']).reset_index()
+        medias_barrio = medias_barrio[medias_barrio['neighbourhood'].isin(selected_barrios)]
+        zoom = st.select_slider("Zoom del mapa", options=list(range(10, 16)), value=11, key="zoom_mapa")
+        fig_mapa = graficos.mapa_barrios(
+            medias_barrio,
+            geometria.geojson_para_zoom(ciudad_actual, zoom),
+            {'lat': df_ciudad['latitude'].mean(), 'lon': df_ciudad['longitude'].mean()},
+            zoom,
+        )
+        mostrar(fig_mapa, "No hay datos para mostrar el mapa por barrio.")
+
+
+# ------------------ Evolución por barrio (histórico de snapshots) ------------------
+if len(main_tabs) > 2:
+    fechas_historico = historico.fechas(ciudad_actual)
+    if len(fechas_historico) > 1:
+        with main_tabs[2]:
+            st.markdown("#### Evolución por barrio entre snapshots")
+            metricas_tendencia = {
+                'n_anuncios': 'Nº de anuncios',
+                'price': 'Precio medio alquiler (€)',
+                'Net ROI (%)': 'ROI Neto (%)',
+                'estimated_revenue_l365d': 'Rentabilidad Estimada (€)',
+                'price_per_m2': 'Precio medio €/m²',
+            }
+            metrica = st.selectbox(
+                "Métrica",
+                options=list(metricas_tendencia),
+                format_func=metricas_tendencia.get,
+                key="metrica_tendencia",
+            )
+            top_barrios = df_ciudad['neighbourhood'].value_counts().head(5).index.tolist()
+            barrios_tendencia = st.multiselect(
+                "Barrios a comparar", options=selected_barrios, default=top_barrios, key="barrios_tendencia"
+            )
+            df_tendencia = historico.tendencias(ciudad_actual, [metrica], barrios=barrios_tendencia)
+            mostrar(
+                graficos.tendencia_barrios(df_tendencia, metrica, metricas_tendencia[metrica]),
+                "No hay histórico de esta métrica para los barrios seleccionados.",
+            )
+
+
 # ------------------ Pestaña 4: Competencia y Demanda ------------------
 if len(main_tabs) > 3:
     with main_tabs[3]:
-        if ciudad_actual == "valencia":
-            st.subheader("Competencia y Demanda por Barrio")
+        if ciudad_actual in ("valencia", "madrid"):
+            if ciudad_actual == "valencia":
+                st.subheader("Competencia y Demanda por Barrio")
+            else:
+                st.subheader("📈 Competencia y Demanda por Barrio en Madrid")
 
             if not df_ciudad.empty:
                 # Competencia por barrio
-                competencia_por_barrio = df_ciudad.groupby('neighbourhood')['id'].count().reset_index().rename(columns={'id': 'n_anuncios'})
-                top_comp = competencia_por_barrio.sort_values(by='n_anuncios', ascending=False).head(15)
-                if not top_comp.empty:
-                    fig_comp = px.bar(
-                        top_comp,
-                        x='n_anuncios',
-                        y='neighbourhood',
-                        orientation='h',
-                        labels={'n_anuncios': 'Nº de anuncios', 'neighbourhood': 'Barrio'},
-                        title='Top 15 barrios con más competencia (nº de anuncios)'
-                    )
-                    st.plotly_chart(fig_comp, use_container_width=True)
-                else:
-                    st.info("No hay datos de competencia para mostrar.")
+                mostrar(figura("Competencia por barrio", df_ciudad, lambda: graficos.competencia_barrio(df_ciudad)), "No hay datos de competencia para mostrar.")
 
                 # Anuncios activos (>30 días alquilados/año)
                 if 'days_rented' in df_ciudad.columns:
-                    activos = df_ciudad[df_ciudad['days_rented'] > 30]
-                    competencia_activa = activos.groupby('neighbourhood')['id'].count().reset_index().rename(columns={'id': 'n_anuncios_activos'})
-                    top_activos = competencia_activa.sort_values(by='n_anuncios_activos', ascending=False).head(15)
-                    if not top_activos.empty:
-                        fig_activos = px.bar(
-                            top_activos,
-                            x='n_anuncios_activos',
-                            y='neighbourhood',
-                            orientation='h',
-                            labels={'n_anuncios_activos': 'Nº de anuncios activos', 'neighbourhood': 'Barrio'},
-                            title='Top 15 barrios con más anuncios activos (>30 días alquilados/año)'
-                        )
-                        st.plotly_chart(fig_activos, use_container_width=True)
-                    else:
-                        st.info("No hay datos de anuncios activos para mostrar.")
+                    mostrar(figura("Anuncios activos por barrio", df_ciudad, lambda: graficos.anuncios_activos_barrio(df_ciudad)), "No hay datos de anuncios activos para mostrar.")
                 else:
                     st.info("No hay datos de días alquilados para mostrar anuncios activos.")
             else:
@@ -386,48 +356,6 @@ if len(main_tabs) > 3:
             st.info("Si la ciudad es Barcelona añadir código aquí")
         elif ciudad_actual == "malaga":
             st.info("Si la ciudad es malaga añadir código aquí")
-        elif ciudad_actual == "madrid":
-            st.subheader("📈 Competencia y Demanda por Barrio en Madrid")
-
-            if not df_ciudad.empty:
-                # Competencia por barrio
-                competencia_por_barrio = df_ciudad.groupby('neighbourhood')['id'].count().reset_index().rename(columns={'id': 'n_anuncios'})
-                top_comp = competencia_por_barrio.sort_values(by='n_anuncios', ascending=False).head(15)
-                if not top_comp.empty:
-                    fig_comp = px.bar(
-                        top_comp,
-                        x='n_anuncios',
-                        y='neighbourhood',
-                        orientation='h',
-                        labels={'n_anuncios': 'Nº de anuncios', 'neighbourhood': 'Barrio'},
-                        title='Top 15 barrios con más competencia (nº de anuncios)'
-                    )
-                    st.plotly_chart(fig_comp, use_container_width=True)
-                else:
-                    st.info("No hay datos de competencia para mostrar.")
-
-                # Anuncios activos (>30 días alquilados/año)
-                if 'days_rented' in df_ciudad.columns:
-                    activos = df_ciudad[df_ciudad['days_rented'] > 30]
-                    competencia_activa = activos.groupby('neighbourhood')['id'].count().reset_index().rename(columns={'id': 'n_anuncios_activos'})
-                    top_activos = competencia_activa.sort_values(by='n_anuncios_activos', ascending=False).head(15)
-                    if not top_activos.empty:
-                        fig_activos = px.bar(
-                            top_activos,
-                            x='n_anuncios_activos',
-                            y='neighbourhood',
-                            orientation='h',
-                            labels={'n_anuncios_activos': 'Nº de anuncios activos', 'neighbourhood': 'Barrio'},
-                            title='Top 15 barrios con más anuncios activos (>30 días alquilados/año)'
-                        )
-                        st.plotly_chart(fig_activos, use_container_width=True)
-                    else:
-                        st.info("No hay datos de anuncios activos para mostrar.")
-                else:
-                    st.info("No hay datos de días alquilados para mostrar anuncios activos.")
-            else:
-                st.info("No hay datos para mostrar en esta pestaña.")
-
         else:
             st.info("No hay datos para mostrar en esta pestaña.")
 else:
@@ -441,365 +369,122 @@ if len(main_tabs) > 4:
             st.subheader("Análisis Avanzado")
         
             if not df_valencia.empty:
-                # Relación entre precio medio de alquiler y ROI neto por barrio
                 st.markdown("#### Relación entre precio medio de alquiler y ROI neto por barrio")
-                if 'city' in df_valencia.columns and df_valencia['city'].str.lower().nunique() == 1 and df_valencia['city'].str.lower().iloc[0] == 'valencia':
-                    if 'price' in df_valencia.columns and 'Net ROI (%)' in df_valencia.columns:
-                        fig_val = px.scatter(
-                            df_valencia,
-                            x='price',
-                            y='Net ROI (%)',
-                            color='neighbourhood',
-                            hover_data=['neighbourhood'],
-                            opacity=0.6,
-                            labels={'price': 'Precio alquiler (€)', 'Net ROI (%)': 'ROI Neto (%)', 'neighbourhood': 'Barrio'},
-                            title='Relación entre precio de alquiler y ROI neto por barrio (Valencia)'
-                        )
-                        fig_val.update_traces(marker=dict(size=10, line=dict(width=1, color='DarkSlateGrey')))
-                        fig_val.update_layout(
-                            legend_title_text='Barrio',
-                            showlegend=False,
-                            height=500,
-                            margin=dict(l=40, r=40, t=60, b=40)
-                        )
-                        st.plotly_chart(fig_val, use_container_width=True)
-                    else:
-                        st.info("No hay datos suficientes para mostrar el gráfico de dispersión para Valencia.")
-                else:
-                    df_barrio = df_valencia.groupby('neighbourhood').agg({'price': 'mean', 'Net ROI (%)': 'mean'}).reset_index()
-                    if not df_barrio.empty:
-                        fig_scatter = px.scatter(
-                            df_barrio,
-                            x='price',
-                            y='Net ROI (%)',
-                            text='neighbourhood',
-                            labels={'price': 'Precio medio alquiler (€)', 'Net ROI (%)': 'ROI Neto (%)'},
-                            title='Precio medio de alquiler vs ROI Neto por barrio'
-                        )
-                        fig_scatter.update_traces(marker=dict(size=12, color='royalblue', line=dict(width=1, color='DarkSlateGrey')))
-                        fig_scatter.update_layout(
-                            height=500,
-                            margin=dict(l=40, r=40, t=60, b=40)
-                        )
-                        st.plotly_chart(fig_scatter, use_container_width=True)
-                    else:
-                        st.info("No hay datos para mostrar la relación entre precio y ROI.")
-
-                # Número medio de amenities por barrio
+                mostrar(figura("Relación entre precio medio de alquiler y ROI neto por barrio", df_valencia, lambda: graficos.precio_vs_roi(df_valencia), datos_valencia), "No hay datos para mostrar la relación entre precio y ROI.")
+
                 st.markdown("#### Top 15 barrios por número medio de amenities")
-                if 'amenities' in df_valencia.columns:
-                    df_valencia['n_amenities'] = df_valencia['amenities'].str.count(',') + 1
-                    barrio_amenities = df_valencia.groupby('neighbourhood')['n_amenities'].mean().reset_index()
-                    barrio_amenities = barrio_amenities.sort_values(by='n_amenities', ascending=False).head(15)
-                    if not barrio_amenities.empty:
-                        fig_amenities = px.bar(
-                            barrio_amenities,
-                            x='n_amenities',
-                            y='neighbourhood',
-                            orientation='h',
-                            labels={'n_amenities': 'Nº medio de amenities', 'neighbourhood': 'Barrio'},
-                            title='Top 15 barrios por número medio de amenities',
-                            color='n_amenities',
-                            color_continuous_scale='Purples'
-                        )
-                        fig_amenities.update_layout(
-                            height=500,
-                            margin=dict(l=40, r=40, t=60, b=40),
-                            yaxis=dict(tickfont=dict(size=12)),
-                            xaxis=dict(tickfont=dict(size=12))
-                        )
-                        st.plotly_chart(fig_amenities, use_container_width=True)
-                    else:
-                        st.info("No hay datos de amenities para mostrar.")
-                else:
-                    st.info("No hay datos de amenities para mostrar.")
+                mostrar(figura("Top 15 barrios por número medio de amenities", df_valencia, lambda: graficos.amenities_barrio(df_valencia), datos_valencia), "No hay datos de amenities para mostrar.")
 
-                # Número total de reseñas por barrio
                 st.markdown("#### Top 15 barrios por número total de reseñas")
-                if 'number_of_reviews' in df_valencia.columns:
-                    barrio_mas_resenas = df_valencia.groupby('neighbourhood')['number_of_reviews'].sum().reset_index()
-                    barrio_mas_resenas = barrio_mas_resenas.sort_values(by='number_of_reviews', ascending=False).head(15)
-                    if not barrio_mas_resenas.empty:
-                        fig_resenas = px.bar(
-                            barrio_mas_resenas,
-                            x='number_of_reviews',
-                            y='neighbourhood',
-                            orientation='h',
-                            labels={'number_of_reviews': 'Número total de reseñas', 'neighbourhood': 'Barrio'},
-                            title='Top 15 barrios por número total de reseñas',
-                            color='number_of_reviews',
-                            color_continuous_scale='Blues'
-                        )
-                        fig_resenas.update_layout(
-                            height=500,
-                            margin=dict(l=40, r=40, t=60, b=40),
-                            yaxis=dict(tickfont=dict(size=12)),
-                            xaxis=dict(tickfont=dict(size=12))
-                        )
-                        st.plotly_chart(fig_resenas, use_container_width=True)
-                    else:
-                        st.info("No hay datos de reseñas para mostrar.")
-                else:
-                    st.info("No hay datos de reseñas para mostrar.")
+                mostrar(figura("Top 15 barrios por número total de reseñas", df_valencia, lambda: graficos.resenas_barrio(df_valencia), datos_valencia), "No hay datos de reseñas para mostrar.")
 
-                # Habitaciones y baños por barrio
                 st.markdown("#### Top 15 barrios por número medio de habitaciones y baños")
-                if 'bedrooms' in df_valencia.columns and 'bathrooms' in df_valencia.columns:
-                    barrio_habitaciones_banos = df_valencia.groupby('neighbourhood').agg({
-                        'bedrooms': 'mean',
-                        'bathrooms': 'mean'
-                    }).reset_index()
-                    barrio_habitaciones_banos = barrio_habitaciones_banos.sort_values(by='bedrooms', ascending=False).head(15)
-                    if not barrio_habitaciones_banos.empty:
-                        fig_hab = px.bar(
-                            barrio_habitaciones_banos,
-                            x='bedrooms',
-                            y='neighbourhood',
-                            orientation='h',
-                            labels={'bedrooms': 'Habitaciones medias', 'neighbourhood': 'Barrio'},
-                            title='Top 15 barrios por número medio de habitaciones',
-                            color='bedrooms',
-                            color_continuous_scale='Teal'
-                        )
-                        fig_hab.update_layout(
-                            height=500,
-                            margin=dict(l=40, r=40, t=60, b=40),
-                            yaxis=dict(tickfont=dict(size=12)),
-                            xaxis=dict(tickfont=dict(size=12))
-                        )
-                        st.plotly_chart(fig_hab, use_container_width=True)
-                    else:
-                        st.info("No hay datos de habitaciones para mostrar.")
-                else:
-                    st.info("No hay datos de habitaciones o baños para mostrar.")
+                mostrar(figura("Top 15 barrios por número medio de habitaciones y baños", df_valencia, lambda: graficos.habitaciones_barrio(df_valencia), datos_valencia), "No hay datos de habitaciones o baños para mostrar.")
 
-                # Histograma de precios de alquiler
                 st.markdown("#### Histograma de precios de alquiler")
-                if 'price' in df_valencia.columns:
-                    fig_hist = px.histogram(
-                        df_valencia, x='price', nbins=40, color='neighbourhood',
-                        labels={'price': 'Precio alquiler (€)'},
-                        title='Distribución de precios de alquiler por barrio',
-                        opacity=0.7
-                    )
-                    fig_hist.update_layout(
-                        height=400,
-                        margin=dict(l=40, r=40, t=60, b=40),
-                        xaxis=dict(tickfont=dict(size=12)),
-                        yaxis=dict(tickfont=dict(size=12)),
-                        barmode='overlay'
-                    )
-                    st.plotly_chart(fig_hist, use_container_width=True)
-                else:
-                    st.info("No hay datos de precios para mostrar histograma.")
+                mostrar(
+                    figura(
+                        "Histograma de precios de alquiler", df_valencia,
+                        lambda: graficos.histograma(df_valencia, 'price', 'Precio alquiler (€)', 'Distribución de precios de alquiler por barrio'),
+                        datos_valencia,
+                    ),
+                    "No hay datos de precios para mostrar histograma.",
+                )
 
-                # Boxplot de precios de alquiler por barrio (solo top 15 barrios)
                 st.markdown("#### Boxplot de precios de alquiler por barrio (Top 15)")
-                if 'price' in df_valencia.columns:
-                    top_barrios = df_valencia['neighbourhood'].value_counts().head(15).index
-                    df_top = df_valencia[df_valencia['neighbourhood'].isin(top_barrios)]
-                    fig_box = px.box(
-                        df_top, x='neighbourhood', y='price', points='outliers',
-                        labels={'price': 'Precio alquiler (€)', 'neighbourhood': 'Barrio'},
-                        title='Boxplot de precios de alquiler por barrio (Top 15)'
-                    )
-                    fig_box.update_layout(
-                        height=500,
-                        margin=dict(l=40, r=40, t=60, b=40),
-                        xaxis=dict(tickangle=45, tickfont=dict(size=12)),
-                        yaxis=dict(tickfont=dict(size=12))
-                    )
-                    st.plotly_chart(fig_box, use_container_width=True)
-                else:
-                    st.info("No hay datos de precios para mostrar boxplot.")
+                mostrar(
+                    figura(
+                        "Boxplot de precios de alquiler por barrio (Top 15)", df_valencia,
+                        lambda: graficos.boxplot_top(datos_valencia, barrios_valencia, 'price', 'Precio alquiler (€)', 'Boxplot de precios de alquiler por barrio (Top 15)'),
+                        datos_valencia,
+                    ),
+                    "No hay datos de precios para mostrar boxplot.",
+                )
 
-                # Histograma de ROI Neto
                 st.markdown("#### Histograma de ROI Neto (%)")
-                if 'Net ROI (%)' in df_valencia.columns:
-                    fig_hist_roi = px.histogram(
-                        df_valencia, x='Net ROI (%)', nbins=40, color='neighbourhood',
-                        labels={'Net ROI (%)': 'ROI Neto (%)'},
-                        title='Distribución de ROI Neto por barrio',
-                        opacity=0.7
-                    )
-                    fig_hist_roi.update_layout(
-                        height=400,
-                        margin=dict(l=40, r=40, t=60, b=40),
-                        xaxis=dict(tickfont=dict(size=12)),
-                        yaxis=dict(tickfont=dict(size=12)),
-                        barmode='overlay'
-                    )
-                    st.plotly_chart(fig_hist_roi, use_container_width=True)
-                else:
-                    st.info("No hay datos de ROI Neto para mostrar histograma.")
+                mostrar(
+                    figura(
+                        "Histograma de ROI Neto (%)", df_valencia,
+                        lambda: graficos.histograma(df_valencia, 'Net ROI (%)', 'ROI Neto (%)', 'Distribución de ROI Neto por barrio'),
+                        datos_valencia,
+                    ),
+                    "No hay datos de ROI Neto para mostrar histograma.",
+                )
 
-                # Boxplot de ROI Neto por barrio (solo top 15 barrios)
                 st.markdown("#### Boxplot de ROI Neto por barrio (Top 15)")
-                if 'Net ROI (%)' in df_valencia.columns:
-                    top_barrios = df_valencia['neighbourhood'].value_counts().head(15).index
-                    df_top = df_valencia[df_valencia['neighbourhood'].isin(top_barrios)]
-                    fig_box_roi = px.box(
-                        df_top, x='neighbourhood', y='Net ROI (%)', points='outliers',
-                        labels={'Net ROI (%)': 'ROI Neto (%)', 'neighbourhood': 'Barrio'},
-                        title='Boxplot de ROI Neto por barrio (Top 15)'
-                    )
-                    fig_box_roi.update_layout(
-                        height=500,
-                        margin=dict(l=40, r=40, t=60, b=40),
-                        xaxis=dict(tickangle=45, tickfont=dict(size=12)),
-                        yaxis=dict(tickfont=dict(size=12))
-                    )
-                    st.plotly_chart(fig_box_roi, use_container_width=True)
-                else:
-                    st.info("No hay datos de ROI Neto para mostrar boxplot.")
+                mostrar(
+                    figura(
+                        "Boxplot de ROI Neto por barrio (Top 15)", df_valencia,
+                        lambda: graficos.boxplot_top(datos_valencia, barrios_valencia, 'Net ROI (%)', 'ROI Neto (%)', 'Boxplot de ROI Neto por barrio (Top 15)'),
+                        datos_valencia,
+                    ),
+                    "No hay datos de ROI Neto para mostrar boxplot.",
+                )
 
-                # Histograma de días alquilados
                 st.markdown("#### Histograma de días alquilados")
-                if 'days_rented' in df_valencia.columns:
-                    fig_hist_days = px.histogram(
-                        df_valencia, x='days_rented', nbins=40, color='neighbourhood',
-                        labels={'days_rented': 'Días alquilados'},
-                        title='Distribución de días alquilados por barrio',
-                        opacity=0.7
-                    )
-                    fig_hist_days.update_layout(
-                        height=400,
-                        margin=dict(l=40, r=40, t=60, b=40),
-                        xaxis=dict(tickfont=dict(size=12)),
-                        yaxis=dict(tickfont=dict(size=12)),
-                        barmode='overlay'
-                    )
-                    st.plotly_chart(fig_hist_days, use_container_width=True)
-                else:
-                    st.info("No hay datos de días alquilados para mostrar histograma.")
+                mostrar(
+                    figura(
+                        "Histograma de días alquilados", df_valencia,
+                        lambda: graficos.histograma(df_valencia, 'days_rented', 'Días alquilados', 'Distribución de días alquilados por barrio'),
+                        datos_valencia,
+                    ),
+                    "No hay datos de días alquilados para mostrar histograma.",
+                )
 
-                # Boxplot de días alquilados por barrio (solo top 15 barrios)
                 st.markdown("#### Boxplot de días alquilados por barrio (Top 15)")
-                if 'days_rented' in df_valencia.columns:
-                    top_barrios = df_valencia['neighbourhood'].value_counts().head(15).index
-                    df_top = df_valencia[df_valencia['neighbourhood'].isin(top_barrios)]
-                    fig_box_days = px.box(
-                        df_top, x='neighbourhood', y='days_rented', points='outliers',
-                        labels={'days_rented': 'Días alquilados', 'neighbourhood': 'Barrio'},
-                        title='Boxplot de días alquilados por barrio (Top 15)'
-                    )
-                    fig_box_days.update_layout(
-                        height=500,
-                        margin=dict(l=40, r=40, t=60, b=40),
-                        xaxis=dict(tickangle=45, tickfont=dict(size=12)),
-                        yaxis=dict(tickfont=dict(size=12))
-                    )
-                    st.plotly_chart(fig_box_days, use_container_width=True)
-                else:
-                    st.info("No hay datos de días alquilados para mostrar boxplot.")
+                mostrar(
+                    figura(
+                        "Boxplot de días alquilados por barrio (Top 15)", df_valencia,
+                        lambda: graficos.boxplot_top(datos_valencia, barrios_valencia, 'days_rented', 'Días alquilados', 'Boxplot de días alquilados por barrio (Top 15)'),
+                        datos_valencia,
+                    ),
+                    "No hay datos de días alquilados para mostrar boxplot.",
+                )
 
-                # Mapa de puntos de los anuncios (si hay lat/lon)
+                # Mapa de anuncios agrupados en la rejilla de celdas (si hay lat/lon)
                 st.markdown("#### Mapa de anuncios")
                 if 'latitude' in df_valencia.columns and 'longitude' in df_valencia.columns:
-                    st.map(df_valencia[['latitude', 'longitude']].dropna())
+                    st.map(datos.puntos_mapa(datos_valencia, df_valencia), size='radio')
                 else:
                     st.info("No hay datos de localización para mostrar el mapa.")
 
                 # Delincuencia: Gráfico de barras agrupadas y heatmap
                 st.markdown("#### Delitos denunciados en Valencia por año")
-                if df_delincuencia is not None and not df_delincuencia.empty:
-                    df_delincuencia_filtrado = df_delincuencia[df_delincuencia['Parámetro'] != 'Total']
-                    fig, ax = plt.subplots(figsize=(14, 7))
-                    sns.barplot(
-                        data=df_delincuencia_filtrado,
-                        x='Año',
-                        y='Denuncias',
-                        hue='Parámetro',
-                        ax=ax
-                    )
-                    ax.set_title('Delitos denunciados en Valencia por año')
-                    ax.set_ylabel('Número de denuncias')
-                    ax.set_xlabel('Año')
-                    ax.legend(title='Tipo de delito', bbox_to_anchor=(1.05, 1), loc='upper left')
-                    plt.tight_layout()
-                    st.pyplot(fig)
-
+                fig_delitos = figura("Delitos denunciados en Valencia por año", None, lambda: graficos.delitos_por_ano(df_delincuencia), datos_valencia)
+                mostrar(fig_delitos, "No hay datos de delincuencia para mostrar.")
+                if fig_delitos is not None:
                     st.markdown("#### Mapa de calor de delitos denunciados en Valencia por tipo y año")
-                    fig2, ax2 = plt.subplots(figsize=(14, 7))
-                    heatmap_data = df_delincuencia_filtrado.pivot_table(
-                        index='Parámetro',
-                        columns='Año',
-                        values='Denuncias',
-                        aggfunc='sum'
-                    ).fillna(0)
-                    sns.heatmap(
-                        heatmap_data,
-                        cmap='YlOrRd',
-                        annot=True,
-                        fmt='.0f',
-                        linewidths=.5,
-                        cbar_kws={'label': 'Número de denuncias'},
-                        annot_kws={"size": 10},
-                        ax=ax2
-                    )
-                    ax2.set_title('Mapa de calor de delitos denunciados en Valencia por tipo y año')
-                    ax2.set_xlabel('Año')
-                    ax2.set_ylabel('Tipo de delito')
-                    plt.xticks(rotation=45)
-                    plt.tight_layout()
-                    st.pyplot(fig2)
-                else:
-                    st.info("No hay datos de delincuencia para mostrar.")
+                    mostrar(figura("Mapa de calor de delitos denunciados en Valencia por tipo y año", None, lambda: graficos.delitos_heatmap(df_delincuencia), datos_valencia), "No hay datos de delincuencia para mostrar.")
             else:
                 st.info("No hay datos para mostrar en esta pestaña.")
 
         elif ciudad_actual.lower() == "barcelona":
-                st.info("Si la ciudad es barcelona añadir codigo aqui")
+            st.info("Si la ciudad es barcelona añadir codigo aqui")
         elif ciudad_actual.lower() == "malaga":
-                st.info("Si la ciudad es malaga añadir codigo aqui")
+            st.info("Si la ciudad es malaga añadir codigo aqui")
         elif ciudad_actual.lower() == "madrid":
-                st.subheader("🔍 Análisis Avanzado para Madrid")
+            st.subheader("🔍 Análisis Avanzado para Madrid")
             
-            # Relación entre precio medio de alquiler y rentabilidad estimada
             st.markdown("#### Relación entre precio medio de alquiler y rentabilidad estimada por barrio")
-            if 'price' in df_ciudad.columns and 'estimated_revenue_l365d' in df_ciudad.columns:
-                fig_scatter = px.scatter(
-                    df_ciudad,
-                    x='price',
-                    y='estimated_revenue_l365d',
-                    color='neighbourhood',
-                    hover_data=['neighbourhood'],
-                    labels={'price': 'Precio alquiler (€)', 'estimated_revenue_l365d': 'Rentabilidad Estimada (€)', 'neighbourhood': 'Barrio'},
-                    title='Relación entre precio de alquiler y rentabilidad estimada por barrio (Madrid)'
-                )
-                st.plotly_chart(fig_scatter, use_container_width=True)
-            else:
-                st.info("No hay datos suficientes para mostrar el gráfico de dispersión.")
+            mostrar(figura("Relación entre precio medio de alquiler y rentabilidad estimada por barrio", df_ciudad, lambda: graficos.precio_vs_rentabilidad(df_ciudad)), "No hay datos suficientes para mostrar el gráfico de dispersión.")
 
-            # Rentabilidad media por número de habitaciones
             st.markdown("#### Rentabilidad media por número de habitaciones")
-            if 'bedrooms' in df_ciudad.columns and 'estimated_revenue_l365d' in df_ciudad.columns:
-                rentabilidad_habitaciones = df_ciudad.groupby('bedrooms')['estimated_revenue_l365d'].mean().reset_index()
-                fig_habitaciones = px.bar(
-                    rentabilidad_habitaciones,
-                    x='bedrooms',
-                    y='estimated_revenue_l365d',
-                    labels={'bedrooms': 'Número de habitaciones', 'estimated_revenue_l365d': 'Rentabilidad Estimada (€)'},
-                    title='Rentabilidad media por número de habitaciones'
-                )
-                st.plotly_chart(fig_habitaciones, use_container_width=True)
-            else:
-                st.info("No hay datos suficientes para mostrar la rentabilidad por número de habitaciones.")
+            mostrar(
+                figura(
+                    "Rentabilidad media por número de habitaciones", df_ciudad,
+                    lambda: graficos.rentabilidad_por(df_ciudad, 'bedrooms', 'Número de habitaciones', 'Rentabilidad media por número de habitaciones'),
+                ),
+                "No hay datos suficientes para mostrar la rentabilidad por número de habitaciones.",
+            )
 
-            # Rentabilidad media por número de baños
             st.markdown("#### Rentabilidad media por número de baños")
-            if 'bathrooms' in df_ciudad.columns and 'estimated_revenue_l365d' in df_ciudad.columns:
-                rentabilidad_banos = df_ciudad.groupby('bathrooms')['estimated_revenue_l365d'].mean().reset_index()
-                fig_banos = px.bar(
-                    rentabilidad_banos,
-                    x='bathrooms',
-                    y='estimated_revenue_l365d',
-                    labels={'bathrooms': 'Número de baños', 'estimated_revenue_l365d': 'Rentabilidad Estimada (€)'},
-                    title='Rentabilidad media por número de baños'
-                )
-                st.plotly_chart(fig_banos, use_container_width=True)
-            else:
-                st.info("No hay datos suficientes para mostrar la rentabilidad por número de baños.")
+            mostrar(
+                figura(
+                    "Rentabilidad media por número de baños", df_ciudad,
+                    lambda: graficos.rentabilidad_por(df_ciudad, 'bathrooms', 'Número de baños', 'Rentabilidad media por número de baños'),
+                ),
+                "No hay datos suficientes para mostrar la rentabilidad por número de baños.",
+            )
         else:
             st.info("No hay datos para mostrar en esta pestaña.")
 
@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+
+# Resúmenes de cuantiles por barrio con sketches fusionables (t-digest).
+# Cada barrio guarda un número acotado de centroides más sus valores extremos,
+# así los boxplots se dibujan con un tamaño constante por barrio y cualquier
+# selección de barrios se resume fusionando sketches, sin ordenar anuncios.
+
+# Columnas para las que se construye un sketch por barrio
+COLUMNAS_SKETCH = ["price", "Net ROI (%)", "days_rented"]
+
+# Compresión del t-digest: como mucho ~COMPRESION centroides por sketch
+COMPRESION = 100
+
+# Valores extremos que se guardan por cada lado para la muestra de outliers
+MAX_OUTLIERS = 30
+
+
+def _k(q, compresion):
+    # Función de escala k1 del t-digest: centroides más finos en las colas
+    return compresion / (2 * np.pi) * np.arcsin(2 * np.clip(q, 0, 1) - 1)
+
+
+def _comprimir(medias, pesos, compresion):
+    orden = np.argsort(medias, kind="stable")
+    medias, pesos = medias[orden], pesos[orden]
+    total = pesos.sum()
+    q_izq = (np.cumsum(pesos) - pesos) / total
+    # Cada centroide cubre como mucho una unidad de la escala k
+    cubo = np.floor(_k(q_izq, compresion) - _k(0, compresion)).astype(np.int64)
+    _, cubo = np.unique(cubo, return_inverse=True)
+    pesos_cubo = np.bincount(cubo, weights=pesos)
+    medias_cubo = np.bincount(cubo, weights=medias * pesos) / pesos_cubo
+    return medias_cubo, pesos_cubo
+
+
+class Sketch:
+    __slots__ = ("medias", "pesos", "minimo", "maximo", "bajos", "altos")
+
+    def __init__(self, medias, pesos, minimo, maximo, bajos, altos):
+        self.medias = medias
+        self.pesos = pesos
+        self.minimo = minimo
+        self.maximo = maximo
+        self.bajos = bajos
+        self.altos = altos
+
+    @classmethod
+    def desde_valores(cls, valores, compresion=COMPRESION):
+        valores = np.asarray(valores, dtype=float)
+        valores = np.sort(valores[~np.isnan(valores)])
+        if len(valores) == 0:
+            return None
+        if len(valores) > compresion:
+            medias, pesos = _comprimir(valores, np.ones(len(valores)), compresion)
+        else:
+            medias, pesos = valores, np.ones(len(valores))
+        return cls(medias, pesos, valores[0], valores[-1], valores[:MAX_OUTLIERS], valores[-MAX_OUTLIERS:])
+
+    @property
+    def n(self):
+        return int(self.pesos.sum())
+
+    @property
+    def exacto(self):
+        # Sin comprimir (hasta COMPRESION valores) los centroides son los valores
+        return bool(np.all(self.pesos == 1))
+
+    def _curva(self):
+        # Interpolación lineal entre los centros de masa de los centroides
+        total = self.pesos.sum()
+        posiciones = (np.cumsum(self.pesos) - self.pesos / 2) / total
+        x = np.concatenate(([0.0], posiciones, [1.0]))
+        y = np.concatenate(([self.minimo], self.medias, [self.maximo]))
+        return x, y
+
+    def cuantiles(self, q):
+        # Con los valores exactos, cuantiles lineales como los de px.box
+        # (quartilemethod='linear'); si no, la curva del t-digest
+        if self.exacto:
+            return np.quantile(self.medias, q)
+        x, y = self._curva()
+        return np.interp(q, x, y)
+
+    def fraccion(self, valor):
+        # Inversa de cuantiles: fracción estimada de valores por debajo de valor
+        x, y = self._curva()
+        return np.interp(valor, y, x)
+
+
+def fusionar(sketches, compresion=COMPRESION):
+    sketches = [s for s in sketches if s is not None]
+    if not sketches:
+        return None
+    if len(sketches) == 1:
+        return sketches[0]
+    medias = np.concatenate([s.medias for s in sketches])
+    pesos = np.concatenate([s.pesos for s in sketches])
+    if len(medias) > compresion:
+        medias, pesos = _comprimir(medias, pesos, compresion)
+    else:
+        orden = np.argsort(medias, kind="stable")
+        medias, pesos = medias[orden], pesos[orden]
+    bajos = np.sort(np.concatenate([s.bajos for s in sketches]))[:MAX_OUTLIERS]
+    altos = np.sort(np.concatenate([s.altos for s in sketches]))[-MAX_OUTLIERS:]
+    return Sketch(
+        medias, pesos,
+        min(s.minimo for s in sketches), max(s.maximo for s in sketches),
+        bajos, altos,
+    )
+
+
+def _bigote_bajo(sketch, valla, q1):
+    # Valor más bajo que queda dentro de la valla. Sin comprimir se tienen
+    # todos los valores; si no, los MAX_OUTLIERS más bajos son exactos y, si
+    # alguno queda dentro, el primero es el bigote. Si todos quedan fuera, se
+    # estima cuántos valores hay por debajo de la valla y se toma el cuantil
+    # del siguiente.
+    valores = sketch.medias if sketch.exacto else sketch.bajos
+    dentro = valores[valores >= valla]
+    if len(dentro):
+        return min(float(dentro[0]), q1)
+    fuera = np.floor(sketch.fraccion(valla) * sketch.n)
+    return min(max(float(sketch.cuantiles((fuera + 0.5) / sketch.n)), valla), q1)
+
+
+def _bigote_alto(sketch, valla, q3):
+    valores = sketch.medias if sketch.exacto else sketch.altos
+    dentro = valores[valores <= valla]
+    if len(dentro):
+        return max(float(dentro[-1]), q3)
+    hasta = np.floor(sketch.fraccion(valla) * sketch.n)
+    return max(min(float(sketch.cuantiles((hasta - 0.5) / sketch.n)), valla), q3)
+
+
+def resumen(sketch):
+    # Resumen de cinco números con vallas de Tukey, bigotes en el dato más
+    # extremo dentro de las vallas y muestra acotada de outliers
+    q1, mediana, q3 = sketch.cuantiles([0.25, 0.5, 0.75]).tolist()
+    iqr = q3 - q1
+    valla_baja = q1 - 1.5 * iqr
+    valla_alta = q3 + 1.5 * iqr
+    outliers = np.concatenate((sketch.bajos[sketch.bajos < valla_baja], sketch.altos[sketch.altos > valla_alta]))
+    return {
+        "n": sketch.n,
+        "minimo": float(sketch.minimo),
+        "q1": q1,
+        "mediana": mediana,
+        "q3": q3,
+        "maximo": float(sketch.maximo),
+        "valla_baja": valla_baja,
+        "valla_alta": valla_alta,
+        "bigote_bajo": _bigote_bajo(sketch, valla_baja, q1),
+        "bigote_alto": _bigote_alto(sketch, valla_alta, q3),
+        "outliers": np.unique(outliers).tolist(),
+    }
+
+
+def sketches_barrio(df, columnas=COLUMNAS_SKETCH, indice=None):
+    # {columna: {barrio: Sketch}} construido una vez en la carga. Con el índice
+    # de bloques de datos.py cada barrio es un slice y no hace falta groupby.
+    if "neighbourhood" not in df.columns:
+        return {}
+    resultado = {}
+    for col in columnas:
+        if col not in df.columns:
+            continue
+        if indice is None:
+            resultado[col] = {
+                barrio: Sketch.desde_valores(valores)
+                for barrio, valores in df.groupby("neighbourhood")[col]
+            }
+        else:
+            valores = df[col].to_numpy(dtype=float, na_value=np.nan)
+            resultado[col] = {
+                barrio: Sketch.desde_valores(valores[inicio:fin])
+                for barrio, (inicio, fin) in indice.items()
+            }
+    return resultado
+
+
+def actualizar_sketches(sketches, df, indice, barrios):
+    # Los sketches no admiten borrar valores: se reconstruyen solo los barrios
+    # tocados, leyendo sus bloques del DataFrame ya actualizado
+    resultado = {col: dict(por_barrio) for col, por_barrio in sketches.items()}
+    tocados = {b: indice[b] for b in barrios if b in indice}
+    for col, nuevos in sketches_barrio(df, list(resultado), tocados).items():
+        for barrio in barrios:
+            resultado[col].pop(barrio, None)
+        resultado[col].update({b: s for b, s in nuevos.items() if s is not None})
+    return resultado
+
+
+def resumenes_barrios(sketches, columna, barrios):
+    # Una fila por barrio con su resumen, en el orden pedido
+    por_barrio = sketches.get(columna, {})
+    filas = []
+    for barrio in barrios:
+        sketch = por_barrio.get(barrio)
+        if sketch is not None:
+            filas.append({"neighbourhood": barrio, **resumen(sketch)})
+    return pd.DataFrame(filas)
+
+
+def resumen_seleccion(sketches, columna, barrios):
+    # Resumen conjunto de varios barrios fusionando sus sketches
+    sketch = fusionar([sketches.get(columna, {}).get(b) for b in barrios])
+    return None if sketch is None else resumen(sketch)
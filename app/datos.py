@@ -0,0 +1,509 @@
+import bisect
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import cuantiles
+
+# Con Copy-on-Write los filtros y selecciones de cada sesión son vistas
+# perezosas: solo se copia una columna si alguien intenta modificarla.
+pd.set_option("mode.copy_on_write", True)
+
+DATA_DIR = "data"
+
+# Archivos de origen por ciudad: nombre lógico -> (archivo, opciones de read_csv)
+FUENTES = {
+    "valencia": {
+        "listings": ("Valencia_limpio.csv", {}),
+        "inmobiliario": ("valencia_vivienda_limpio.csv", {}),
+        "delincuencia": ("crimenValencia.csv", {"sep": ";"}),
+    },
+    "barcelona": {
+        "listings": ("barcelona_limpio_completo.csv", {}),
+        "inversores": ("barcelona_inversores.csv", {}),
+    },
+    "malaga": {
+        "listings": ("malaga_limpio.csv", {}),
+    },
+    "madrid": {
+        "listings": ("madrid_limpio.csv", {}),
+    },
+}
+
+# Tipos explícitos de las columnas que usa el panel, para que el lector de CSV
+# no tenga que inferirlos. Las columnas que no aparecen en un archivo se ignoran.
+# Las de texto no se fijan: con engine="pyarrow" y dtype=str una celda vacía
+# llega como la cadena 'None' en vez de como nulo; Arrow ya las infiere como texto.
+DTYPES = {
+    "id": "int64",
+    "host_id": "int64",
+    "latitude": "float64",
+    "longitude": "float64",
+    "price": "float64",
+    "accommodates": "float64",
+    "bedrooms": "float64",
+    "bathrooms": "float64",
+    "beds": "float64",
+    "availability_365": "float64",
+    "days_rented": "float64",
+    "number_of_reviews": "float64",
+    "estimated_occupancy_l365d": "float64",
+    "estimated_revenue_l365d": "float64",
+    "price_per_m2_jun2025": "float64",
+    "precio": "float64",
+    "Año": "int64",
+    "Denuncias": "float64",
+}
+
+# Supuestos del cálculo de ROI
+AVERAGE_M2 = 70
+GASTOS_ANUALES = 3000
+PRECIO_M2_FALLBACK = 2000
+
+# Segundos entre comprobaciones de los archivos de origen de cada ciudad
+TTL = 3600
+
+# Columnas que se calculan en la carga y no vienen de los archivos de origen
+COLUMNAS_DERIVADAS = [
+    "annual_income", "estimated_property_value", "ROI (%)",
+    "net_annual_income", "Net ROI (%)", "n_amenities",
+]
+
+# Métricas que se acumulan por barrio (suma y nº de valores no nulos) para
+# poder actualizar medias sin recorrer de nuevo todos los anuncios
+METRICAS_BARRIO = [
+    "price", "ROI (%)", "Net ROI (%)", "estimated_revenue_l365d",
+    "price_per_m2_jun2025", "days_rented", "n_amenities", "number_of_reviews",
+    "bedrooms", "bathrooms",
+]
+
+# Tamaño de celda (grados) de la rejilla de anuncios para los mapas
+TAMANO_CELDA = 0.005
+
+# Metros por grado de latitud, para el radio de los puntos del mapa
+METROS_GRADO = 111_000
+
+logger = logging.getLogger(__name__)
+
+_cache = {}
+_lock = threading.Lock()
+# Un cerrojo por ciudad para que varias ciudades puedan cargarse a la vez
+_locks_ciudad = {}
+# Identificador de cada versión construida, para invalidar cachés derivadas
+_generaciones = itertools.count(1)
+
+
+def _solo_lectura(df):
+    # Reconstruye el DataFrame columna a columna sobre arrays de solo lectura,
+    # así ninguna sesión puede modificar los datos compartidos por accidente.
+    columnas = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, np.dtype):
+            valores = df[col].to_numpy(copy=True)
+            valores.flags.writeable = False
+            columnas[col] = valores
+        else:
+            columnas[col] = df[col].array
+    return pd.DataFrame(columnas, index=df.index, copy=False)
+
+
+def derivar_columnas(df, df_inmobiliario=None):
+    # Columnas derivadas que antes se calculaban en cada ejecución del script
+    df = df.copy()
+    if "price" in df.columns:
+        df["price"] = df["price"].astype(float)
+    if "amenities" in df.columns:
+        df["n_amenities"] = df["amenities"].str.count(",") + 1
+    if "price" in df.columns and "days_rented" in df.columns:
+        if df_inmobiliario is not None and "precio" in df_inmobiliario.columns:
+            precio_m2 = df_inmobiliario["precio"].mean()
+        else:
+            precio_m2 = PRECIO_M2_FALLBACK
+        df["annual_income"] = df["price"] * df["days_rented"]
+        df["estimated_property_value"] = precio_m2 * AVERAGE_M2
+        df["ROI (%)"] = (df["annual_income"] / df["estimated_property_value"]) * 100
+        df["net_annual_income"] = df["annual_income"] - GASTOS_ANUALES
+        df["Net ROI (%)"] = (df["net_annual_income"] / df["estimated_property_value"]) * 100
+    return df
+
+
+def calcular_indice_barrios(df):
+    # Posiciones [inicio, fin) de cada barrio en el DataFrame ordenado
+    if "neighbourhood" not in df.columns or df.empty:
+        return {}
+    barrios = df["neighbourhood"].to_numpy()
+    cortes = np.flatnonzero(barrios[1:] != barrios[:-1]) + 1
+    inicios = np.concatenate(([0], cortes))
+    fines = np.concatenate((cortes, [len(df)]))
+    return {barrios[i]: (i, f) for i, f in zip(inicios, fines) if pd.notna(barrios[i])}
+
+
+def _acumular(df, claves):
+    cols = [c for c in METRICAS_BARRIO if c in df.columns]
+    grupos = df.groupby(claves, dropna=True)
+    acumulado = grupos[cols].sum().add_suffix("_suma")
+    acumulado = acumulado.join(grupos[cols].count().add_suffix("_n"))
+    acumulado.insert(0, "n_anuncios", grupos.size())
+    return acumulado
+
+
+def sumas_barrio(df):
+    if "neighbourhood" not in df.columns:
+        return pd.DataFrame()
+    return _acumular(df, "neighbourhood")
+
+
+def celdas_mapa(df):
+    # Rejilla de anuncios por celda lat/lon, aditiva como los agregados por barrio
+    if "latitude" not in df.columns or "longitude" not in df.columns:
+        return pd.DataFrame()
+    celdas = df.assign(
+        celda_lat=np.floor(df["latitude"] / TAMANO_CELDA).astype("Int64"),
+        celda_lon=np.floor(df["longitude"] / TAMANO_CELDA).astype("Int64"),
+    )
+    return _acumular(celdas, ["celda_lat", "celda_lon"])
+
+
+def puntos_mapa(datos_ciudad, df):
+    # Un punto por celda en el centro de la celda, con radio (metros) según la
+    # raíz del número de anuncios: la celda más poblada llena su celda. Con la
+    # vista por defecto se usa la rejilla ya calculada; con barrios filtrados se
+    # agrupa solo el subconjunto.
+    celdas = datos_ciudad["celdas"] if df is datos_ciudad["listings"] else celdas_mapa(df)
+    if celdas.empty:
+        return pd.DataFrame(columns=["latitude", "longitude", "n_anuncios", "radio"])
+    puntos = pd.DataFrame({
+        "latitude": (celdas.index.get_level_values("celda_lat").to_numpy(dtype=float) + 0.5) * TAMANO_CELDA,
+        "longitude": (celdas.index.get_level_values("celda_lon").to_numpy(dtype=float) + 0.5) * TAMANO_CELDA,
+        "n_anuncios": celdas["n_anuncios"].to_numpy(),
+    })
+    puntos["radio"] = METROS_GRADO * TAMANO_CELDA / 2 * np.sqrt(puntos["n_anuncios"] / puntos["n_anuncios"].max())
+    return puntos
+
+
+def calcular_distritos(df):
+    # Barrios de cada distrito (neighbourhood_group -> [neighbourhood])
+    if "neighbourhood_group" not in df.columns or "neighbourhood" not in df.columns:
+        return {}
+    pares = df[["neighbourhood_group", "neighbourhood"]].dropna().drop_duplicates()
+    return {
+        grupo: sorted(barrios)
+        for grupo, barrios in pares.groupby("neighbourhood_group")["neighbourhood"]
+    }
+
+
+def sumas_distrito(agregados, distritos):
+    # Totales por distrito a partir de las sumas parciales de sus barrios, sin
+    # volver a recorrer los anuncios
+    barrio_a_distrito = {b: grupo for grupo, barrios in distritos.items() for b in barrios}
+    if not barrio_a_distrito or agregados.empty:
+        return pd.DataFrame()
+    return agregados.groupby(agregados.index.map(barrio_a_distrito)).sum().rename_axis("neighbourhood_group")
+
+
+def actualizar_acumulado(acumulado, quitados, nuevos):
+    # Resta la contribución de las filas quitadas y suma la de las nuevas
+    resultado = acumulado.sub(quitados, fill_value=0).add(nuevos, fill_value=0)
+    return resultado[resultado["n_anuncios"] > 0]
+
+
+def medias(acumulado):
+    # Medias por grupo a partir de las sumas parciales
+    resultado = acumulado[["n_anuncios"]].copy()
+    for col in acumulado.columns:
+        if col.endswith("_suma"):
+            metrica = col[: -len("_suma")]
+            resultado[metrica] = acumulado[col] / acumulado[f"{metrica}_n"].replace(0, np.nan)
+    return resultado
+
+
+def preparar_listings(df, df_inmobiliario=None, derivar=True):
+    if derivar:
+        df = derivar_columnas(df, df_inmobiliario)
+    if "neighbourhood" in df.columns:
+        # Ordenado por distrito y barrio para que cada barrio, y cada distrito
+        # completo, sea un bloque contiguo de filas
+        orden = [c for c in ("neighbourhood_group", "neighbourhood") if c in df.columns]
+        df = df.sort_values(orden, kind="stable").reset_index(drop=True)
+    return _solo_lectura(df)
+
+
+def _clave_bloque(grupo, barrio):
+    # Orden de sort_values(["neighbourhood_group", "neighbourhood"]): nulos al final
+    return (pd.isna(grupo), "" if pd.isna(grupo) else grupo, barrio)
+
+
+def empalmar_listings(df, indice, quitar, nuevas):
+    # Quita las filas marcadas en `quitar` y mete `nuevas` (ya derivadas) al final
+    # del bloque de su barrio, sin volver a ordenar toda la tabla: cada columna se
+    # copia una sola vez con un take. Los barrios nuevos se colocan donde los
+    # habría puesto preparar_listings.
+    tiene_grupo = "neighbourhood_group" in df.columns
+    bloques = sorted(indice.items(), key=lambda item: item[1][0])
+    claves = [
+        _clave_bloque(df["neighbourhood_group"].iat[inicio] if tiene_grupo else None, barrio)
+        for barrio, (inicio, _) in bloques
+    ]
+    fin_barrios = bloques[-1][1][1] if bloques else 0
+    # Las filas nuevas que caen en la misma posición quedan en orden de barrio
+    grupos = nuevas["neighbourhood_group"] if tiene_grupo else pd.Series(None, index=nuevas.index)
+    claves_nuevas = [(pd.isna(b), _clave_bloque(g, "" if pd.isna(b) else b)) for g, b in zip(grupos, nuevas["neighbourhood"])]
+    orden_nuevas = sorted(range(len(nuevas)), key=claves_nuevas.__getitem__)
+    nuevas = nuevas.iloc[orden_nuevas]
+    grupos = grupos.iloc[orden_nuevas]
+    posiciones = np.empty(len(nuevas), dtype=np.int64)
+    for i, (grupo, barrio) in enumerate(zip(grupos, nuevas["neighbourhood"])):
+        if pd.isna(barrio):
+            posiciones[i] = len(df)
+        elif barrio in indice:
+            posiciones[i] = indice[barrio][1]
+        else:
+            siguiente = bisect.bisect_right(claves, _clave_bloque(grupo, barrio))
+            posiciones[i] = bloques[siguiente][1][0] if siguiente < len(bloques) else fin_barrios
+
+    # Las filas nuevas van justo antes de la fila antigua que ocupa su posición
+    conservadas = np.flatnonzero(~np.asarray(quitar))
+    orden = np.argsort(np.concatenate((conservadas * 2 + 1, posiciones * 2)), kind="stable")
+    columnas = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, np.dtype) and isinstance(nuevas[col].dtype, np.dtype):
+            anteriores, agregadas = df[col].to_numpy(), nuevas[col].to_numpy()
+            valores = np.concatenate((anteriores[conservadas], agregadas.astype(np.result_type(anteriores, agregadas))))[orden]
+            valores.flags.writeable = False
+        else:
+            valores = pd.concat([df[col].iloc[conservadas], nuevas[col]], ignore_index=True).array.take(orden)
+        columnas[col] = valores
+    return pd.DataFrame(columnas, copy=False)
+
+
+def actualizar_distritos(distritos, nuevas, indice):
+    # Añade los pares distrito-barrio de las filas nuevas y quita los barrios
+    # que se han quedado sin anuncios
+    if "neighbourhood_group" not in nuevas.columns or "neighbourhood" not in nuevas.columns:
+        return distritos
+    resultado = {grupo: set(barrios) for grupo, barrios in distritos.items()}
+    for grupo, barrio in nuevas[["neighbourhood_group", "neighbourhood"]].dropna().drop_duplicates().itertuples(index=False):
+        resultado.setdefault(grupo, set()).add(barrio)
+    resultado = {grupo: sorted(b for b in barrios if b in indice) for grupo, barrios in resultado.items()}
+    return {grupo: barrios for grupo, barrios in resultado.items() if barrios}
+
+
+def _leer_csv(ruta, opciones):
+    inicio = time.perf_counter()
+    try:
+        # Lector de Arrow: multihilo y sin pasada de inferencia para las columnas de DTYPES
+        df = pd.read_csv(ruta, engine="pyarrow", dtype=DTYPES, **opciones)
+    except Exception as e:
+        logger.warning("Lector pyarrow falló con %s (%s), se usa el lector por defecto", ruta, e)
+        df = pd.read_csv(ruta, **opciones)
+    return df, time.perf_counter() - inicio
+
+
+def leer_fuentes(ciudad, data_dir=DATA_DIR, tiempos=None):
+    # Lee todos los archivos de la ciudad a la vez: el tiempo total queda
+    # acotado por el archivo más grande y no por la suma de todos
+    fuentes = FUENTES[ciudad]
+    with ThreadPoolExecutor(max_workers=len(fuentes)) as pool:
+        futuros = {
+            nombre: pool.submit(_leer_csv, os.path.join(data_dir, archivo), opciones)
+            for nombre, (archivo, opciones) in fuentes.items()
+        }
+        tablas = {}
+        for nombre, futuro in futuros.items():
+            tablas[nombre], segundos = futuro.result()
+            logger.info("%s/%s: %d filas en %.2f s", ciudad, nombre, len(tablas[nombre]), segundos)
+            if tiempos is not None:
+                tiempos[nombre] = segundos
+    return tablas
+
+
+def construir_ciudad(ciudad, tablas):
+    # A partir de las tablas crudas genera el conjunto compartido de la ciudad
+    datos = {}
+    for nombre, df in tablas.items():
+        if nombre == "listings":
+            continue
+        datos[nombre] = _solo_lectura(df)
+    listings = preparar_listings(tablas["listings"], tablas.get("inmobiliario"))
+    datos["listings"] = listings
+    datos["indice_barrios"] = calcular_indice_barrios(listings)
+    datos["agregados"] = sumas_barrio(listings)
+    datos["distritos"] = calcular_distritos(listings)
+    datos["agregados_distrito"] = sumas_distrito(datos["agregados"], datos["distritos"])
+    datos["celdas"] = celdas_mapa(listings)
+    datos["sketches"] = cuantiles.sketches_barrio(listings, indice=datos["indice_barrios"])
+    datos["version"] = None
+    datos["generacion"] = nueva_generacion()
+    return datos
+
+
+def archivo_version(ciudad, data_dir=DATA_DIR):
+    # Fecha del último snapshot aplicado, escrita por actualizacion.py
+    return os.path.join(data_dir, f"{ciudad}_version.json")
+
+
+def leer_version(ciudad, data_dir=DATA_DIR):
+    # None si los datos vienen directamente de los notebooks
+    try:
+        with open(archivo_version(ciudad, data_dir), encoding="utf-8") as f:
+            return json.load(f)["snapshot"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _construir_desde_disco(ciudad, data_dir):
+    tiempos = {}
+    nuevos = construir_ciudad(ciudad, leer_fuentes(ciudad, data_dir, tiempos))
+    nuevos["tiempos_carga"] = tiempos
+    nuevos["version"] = leer_version(ciudad, data_dir)
+    return nuevos
+
+
+def nueva_generacion():
+    return next(_generaciones)
+
+
+def _mtimes(ciudad, data_dir):
+    return {
+        archivo: os.path.getmtime(os.path.join(data_dir, archivo))
+        for archivo, _ in FUENTES[ciudad].values()
+    }
+
+
+def _lock_ciudad(ciudad):
+    with _lock:
+        return _locks_ciudad.setdefault(ciudad, threading.Lock())
+
+
+def publicar(ciudad, datos, data_dir=DATA_DIR):
+    # Sustituye de forma atómica la versión que ven las sesiones
+    with _lock_ciudad(ciudad.lower()):
+        _cache[ciudad.lower()] = (time.monotonic(), _mtimes(ciudad.lower(), data_dir), datos)
+
+
+def cargar_ciudad(ciudad, data_dir=DATA_DIR):
+    # Caché de proceso: todas las sesiones reciben el mismo objeto, sin copias
+    # Al caducar el TTL solo se vuelve a leer si los archivos han cambiado
+    ciudad = ciudad.lower()
+    with _lock_ciudad(ciudad):
+        entrada = _cache.get(ciudad)
+        if entrada is not None and time.monotonic() - entrada[0] > TTL:
+            mtimes = _mtimes(ciudad, data_dir)
+            if mtimes == entrada[1]:
+                entrada = (time.monotonic(), mtimes, entrada[2])
+                _cache[ciudad] = entrada
+            else:
+                entrada = None
+        if entrada is None:
+            mtimes = _mtimes(ciudad, data_dir)
+            nuevos = _construir_desde_disco(ciudad, data_dir)
+            entrada = (time.monotonic(), mtimes, nuevos)
+            _cache[ciudad] = entrada
+        return entrada[2]
+
+
+def caduca_en(ciudad):
+    # Segundos que le quedan a la versión en caché (None si no está cargada)
+    entrada = _cache.get(ciudad.lower())
+    return None if entrada is None else TTL - (time.monotonic() - entrada[0])
+
+
+def tiempos_carga():
+    # {ciudad: {archivo: segundos}} de la última lectura de cada ciudad en caché
+    return {ciudad: entrada[2].get("tiempos_carga", {}) for ciudad, entrada in list(_cache.items())}
+
+
+def recargar(ciudad, data_dir=DATA_DIR):
+    # Renueva la versión en caché antes de que caduque. La nueva se construye
+    # fuera del lock: mientras tanto las sesiones siguen recibiendo la anterior.
+    ciudad = ciudad.lower()
+    entrada = _cache.get(ciudad)
+    mtimes = _mtimes(ciudad, data_dir)
+    if entrada is not None and entrada[1] == mtimes:
+        nuevos = entrada[2]
+    else:
+        nuevos = _construir_desde_disco(ciudad, data_dir)
+    with _lock_ciudad(ciudad):
+        actual = _cache.get(ciudad)
+        if actual is not None and actual is not entrada:
+            # Otro hilo ha publicado o renovado la ciudad entretanto
+            return actual[2]
+        _cache[ciudad] = (time.monotonic(), mtimes, nuevos)
+    return nuevos
+
+
+def cargar_ciudades(ciudades, data_dir=DATA_DIR):
+    # Carga varias ciudades en paralelo; devuelve {ciudad: datos o excepción}
+    def cargar(ciudad):
+        try:
+            return cargar_ciudad(ciudad, data_dir)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(ciudades)) as pool:
+        return dict(zip(ciudades, pool.map(cargar, ciudades)))
+
+
+def invalidar(ciudad=None):
+    with _lock:
+        if ciudad is None:
+            _cache.clear()
+        else:
+            _cache.pop(ciudad.lower(), None)
+
+
+def barrios_de(datos, distritos):
+    # Todos los barrios de los distritos indicados
+    return [b for grupo in distritos for b in datos["distritos"].get(grupo, [])]
+
+
+def vista_barrios(datos, seleccion):
+    # Devuelve los anuncios de los barrios seleccionados sin copiar los datos
+    # cuando es posible: si los barrios forman un bloque contiguo (todos, uno,
+    # o distritos completos) se devuelve un slice del DataFrame compartido.
+    df = datos["listings"]
+    indice = datos["indice_barrios"]
+    seleccion = set(b for b in seleccion if b in indice)
+    if len(seleccion) == len(indice):
+        return df
+    if not seleccion:
+        return df.iloc[0:0]
+    tramos = sorted(indice[b] for b in seleccion)
+    if all(a[1] == b[0] for a, b in zip(tramos[:-1], tramos[1:])):
+        return df.iloc[tramos[0][0]:tramos[-1][1]]
+    posiciones = np.concatenate([np.arange(inicio, fin) for inicio, fin in tramos])
+    return df.iloc[posiciones]
+
+
+def comprobar_nulos(ciudad, data_dir=DATA_DIR):
+    # Compara los nulos por columna del lector de Arrow con los del lector por
+    # defecto; devuelve {archivo: {columna: (arrow, por_defecto)}} con las diferencias
+    diferencias = {}
+    for archivo, opciones in FUENTES[ciudad].values():
+        ruta = os.path.join(data_dir, archivo)
+        arrow = _leer_csv(ruta, opciones)[0].isna().sum()
+        por_defecto = pd.read_csv(ruta, **opciones).isna().sum()
+        distintas = arrow.index[arrow.reindex(por_defecto.index).ne(por_defecto)]
+        if len(distintas):
+            diferencias[archivo] = {c: (int(arrow[c]), int(por_defecto[c])) for c in distintas}
+    return diferencias
+
+
+if __name__ == "__main__":
+    for ciudad in FUENTES:
+        tiempos = {}
+        try:
+            leer_fuentes(ciudad, tiempos=tiempos)
+            diferencias = comprobar_nulos(ciudad)
+        except FileNotFoundError as e:
+            print(f"{ciudad}: {e}")
+            continue
+        print(f"{ciudad}: " + ", ".join(f"{nombre} {segundos:.2f} s" for nombre, segundos in tiempos.items()))
+        print(f"{ciudad}: nulos iguales en ambos lectores" if not diferencias else f"{ciudad}: {diferencias}")
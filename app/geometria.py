@@ -0,0 +1,271 @@
+import gzip
+import json
+import os
+import threading
+
+import numpy as np
+
+import datos
+
+# Geometrías de barrios por ciudad
+GEOJSON_CIUDAD = {
+    "valencia": "neighbourhoods.geojson",
+    "madrid": "neighbourhoods_madrid.geojson",
+}
+
+GEOMETRIA_DIR = os.path.join(datos.DATA_DIR, "geometria")
+
+# Tolerancia de simplificación (grados) por nivel de detalle: ~200 m, ~40 m y
+# ~10 m, en torno a 2-3 píxeles con el zoom de cada nivel
+NIVELES = {"bajo": 0.002, "medio": 0.0004, "alto": 0.0001}
+
+# Decimales de las coordenadas que se envían al navegador en cada nivel. Con 3
+# decimales (~100 m) algunos bordes compartidos cortos se quedan en un punto.
+DECIMALES = {"bajo": 4, "medio": 4, "alto": 5}
+
+# Rejilla de cuantización: 1e-5 grados (~1 m), suficiente para el mayor nivel de detalle
+ESCALA = 100000
+
+# Versión del formato de la caché en disco: si cambia, se vuelve a preprocesar
+FORMATO = 2
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def nivel_para_zoom(zoom):
+    # Nivel de detalle según el zoom del mapa (escala de teselas web)
+    if zoom >= 14:
+        return "alto"
+    if zoom >= 12:
+        return "medio"
+    return "bajo"
+
+
+def _douglas_peucker(puntos, tolerancia):
+    # Devuelve una máscara con los puntos que se conservan (extremos siempre)
+    n = len(puntos)
+    conservar = np.zeros(n, dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        inicio, fin = pila.pop()
+        if fin - inicio < 2:
+            continue
+        a, b = puntos[inicio], puntos[fin]
+        tramo = puntos[inicio + 1:fin]
+        ab = b - a
+        longitud = np.hypot(*ab)
+        if longitud == 0:
+            distancias = np.hypot(*(tramo - a).T)
+        else:
+            distancias = np.abs(ab[0] * (tramo[:, 1] - a[1]) - ab[1] * (tramo[:, 0] - a[0])) / longitud
+        i = int(np.argmax(distancias))
+        if distancias[i] > tolerancia:
+            medio = inicio + 1 + i
+            conservar[medio] = True
+            pila.append((inicio, medio))
+            pila.append((medio, fin))
+    return conservar
+
+
+def _anillos(geometria):
+    # Lista de polígonos, cada uno como lista de anillos de puntos cuantizados
+    if geometria["type"] == "Polygon":
+        poligonos = [geometria["coordinates"]]
+    else:
+        poligonos = geometria["coordinates"]
+    return [
+        [_sin_repetidos([(round(x * ESCALA), round(y * ESCALA)) for x, y in anillo[:-1]]) for anillo in poligono]
+        for poligono in poligonos
+    ]
+
+
+def _sin_repetidos(anillo):
+    # Quita puntos consecutivos iguales (también entre el último y el primero),
+    # que aparecen al cuantizar o redondear puntos muy próximos
+    return [p for i, p in enumerate(anillo) if p != anillo[i - 1]] or anillo[:1]
+
+
+def _nudos(features):
+    # Un punto es nudo si tiene más de dos vecinos distintos entre todos los
+    # anillos que pasan por él: ahí empieza o acaba un borde compartido
+    vecinos = {}
+    for poligonos in features:
+        for poligono in poligonos:
+            for anillo in poligono:
+                n = len(anillo)
+                for i, p in enumerate(anillo):
+                    vecinos.setdefault(p, set()).update((anillo[i - 1], anillo[(i + 1) % n]))
+    return {p for p, v in vecinos.items() if len(v) > 2}
+
+
+def _arcos_de_anillo(anillo, nudos):
+    # Corta el anillo en arcos que empiezan y acaban en nudos. Sin nudos, el
+    # anillo completo es un arco que empieza en su punto mínimo.
+    cortes = [i for i, p in enumerate(anillo) if p in nudos]
+    if not cortes:
+        inicio = anillo.index(min(anillo))
+        rotado = anillo[inicio:] + anillo[:inicio]
+        return [rotado + [rotado[0]]]
+    rotado = anillo[cortes[0]:] + anillo[:cortes[0]]
+    cortes = [c - cortes[0] for c in cortes] + [len(anillo)]
+    rotado = rotado + [rotado[0]]
+    return [rotado[a:b + 1] for a, b in zip(cortes[:-1], cortes[1:])]
+
+
+def _canonico(arco):
+    # Mismo sentido para un arco y su inverso, para simplificarlo una sola vez
+    inverso = arco[::-1]
+    if (arco[0], arco[1], arco[-2]) <= (inverso[0], inverso[1], inverso[-2]):
+        return tuple(arco), False
+    return tuple(inverso), True
+
+
+def simplificar(geojson):
+    # Simplificación por arcos compartidos: cada borde entre dos barrios se
+    # simplifica una única vez, así los barrios vecinos siguen encajando.
+    features = [_anillos(f["geometry"]) for f in geojson["features"]]
+    nudos = _nudos(features)
+
+    arcos = {}
+    estructura = []
+    for poligonos in features:
+        polis = []
+        for poligono in poligonos:
+            anillos = []
+            for anillo in poligono:
+                partes = []
+                for arco in _arcos_de_anillo(anillo, nudos):
+                    clave, invertido = _canonico(arco)
+                    arcos.setdefault(clave, None)
+                    partes.append((clave, invertido))
+                anillos.append(partes)
+            polis.append(anillos)
+        estructura.append(polis)
+
+    niveles = {}
+    for nivel, tolerancia in NIVELES.items():
+        simplificados = {}
+        for clave in arcos:
+            puntos = np.array(clave, dtype=float)
+            mascara = _douglas_peucker(puntos, tolerancia * ESCALA)
+            simplificados[clave] = [clave[i] for i in np.flatnonzero(mascara)]
+
+        geometrias = []
+        for polis in estructura:
+            poligonos = []
+            for anillos in polis:
+                nuevos = []
+                for partes in anillos:
+                    anillo = _unir(partes, simplificados)
+                    if len(anillo) < 3:
+                        # Anillo degenerado: se conserva sin simplificar
+                        anillo = _unir(partes, {c: list(c) for c, _ in partes})
+                    nuevos.append(_codificar(anillo))
+                poligonos.append(nuevos)
+            geometrias.append(poligonos)
+        niveles[nivel] = geometrias
+
+    return {
+        "formato": FORMATO,
+        "escala": ESCALA,
+        "barrios": [f["properties"]["neighbourhood"] for f in geojson["features"]],
+        "niveles": niveles,
+    }
+
+
+def _unir(partes, arcos):
+    # Anillo abierto: el último arco acaba en el primer punto y no se repite
+    anillo = []
+    for clave, invertido in partes:
+        puntos = arcos[clave][::-1] if invertido else arcos[clave]
+        anillo.extend(puntos[:-1])
+    return anillo
+
+
+def _codificar(anillo):
+    # Coordenadas enteras en diferencias respecto al punto anterior
+    array = np.array(anillo, dtype=np.int64)
+    array[1:] = np.diff(array, axis=0)
+    return array.ravel().tolist()
+
+
+def _decodificar(codificado, escala, decimales):
+    array = np.cumsum(np.array(codificado, dtype=np.int64).reshape(-1, 2), axis=0) / escala
+    return _sin_repetidos(array.round(decimales).tolist())
+
+
+def _ruta_cache(ciudad, geometria_dir):
+    return os.path.join(geometria_dir, f"{ciudad}.json.gz")
+
+
+def preprocesar(ciudad, data_dir=datos.DATA_DIR, geometria_dir=GEOMETRIA_DIR):
+    # Calcula y guarda todas las resoluciones de una ciudad
+    with open(os.path.join(data_dir, GEOJSON_CIUDAD[ciudad]), encoding="utf-8") as f:
+        resultado = simplificar(json.load(f))
+    os.makedirs(geometria_dir, exist_ok=True)
+    ruta = _ruta_cache(ciudad, geometria_dir)
+    with gzip.open(ruta + ".tmp", "wt", encoding="utf-8") as f:
+        json.dump(resultado, f, separators=(",", ":"))
+    os.replace(ruta + ".tmp", ruta)
+    return resultado
+
+
+def _cargar(ciudad, data_dir, geometria_dir):
+    ruta = _ruta_cache(ciudad, geometria_dir)
+    origen = os.path.join(data_dir, GEOJSON_CIUDAD[ciudad])
+    if os.path.exists(ruta) and os.path.getmtime(ruta) >= os.path.getmtime(origen):
+        with gzip.open(ruta, "rt", encoding="utf-8") as f:
+            cacheado = json.load(f)
+        if cacheado.get("formato") == FORMATO:
+            return cacheado
+    return preprocesar(ciudad, data_dir, geometria_dir)
+
+
+def geojson(ciudad, nivel="medio", data_dir=datos.DATA_DIR, geometria_dir=GEOMETRIA_DIR):
+    # GeoJSON de barrios en el nivel de detalle pedido (None si la ciudad no tiene)
+    ciudad = ciudad.lower()
+    if ciudad not in GEOJSON_CIUDAD:
+        return None
+    with _lock:
+        if (ciudad, nivel) not in _cache:
+            cacheado = _cargar(ciudad, data_dir, geometria_dir)
+            for n, geometrias in cacheado["niveles"].items():
+                # El barrio va en el id de cada feature y no en properties: con
+                # decenas de barrios y pocos puntos por barrio en el nivel bajo,
+                # las propiedades eran una parte apreciable del tamaño
+                _cache[(ciudad, n)] = {
+                    "type": "FeatureCollection",
+                    "features": [
+                        {"type": "Feature", "id": barrio, "geometry": _geometria(poligonos, cacheado["escala"], DECIMALES[n])}
+                        for barrio, poligonos in zip(cacheado["barrios"], geometrias)
+                    ],
+                }
+        return _cache[(ciudad, nivel)]
+
+
+def _geometria(poligonos, escala, decimales):
+    coordenadas = [
+        [_cerrar(_decodificar(anillo, escala, decimales)) for anillo in poligono]
+        for poligono in poligonos
+    ]
+    if len(coordenadas) == 1:
+        return {"type": "Polygon", "coordinates": coordenadas[0]}
+    return {"type": "MultiPolygon", "coordinates": coordenadas}
+
+
+def geojson_para_zoom(ciudad, zoom):
+    return geojson(ciudad, nivel_para_zoom(zoom))
+
+
+def _cerrar(anillo):
+    return anillo + [anillo[0]]
+
+
+if __name__ == "__main__":
+    for ciudad in GEOJSON_CIUDAD:
+        resultado = preprocesar(ciudad)
+        for nivel in NIVELES:
+            tamano = len(json.dumps(geojson(ciudad, nivel), separators=(",", ":")))
+            print(f"{ciudad} [{nivel}]: {tamano / 1024:.0f} KB")
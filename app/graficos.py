@@ -0,0 +1,469 @@
+import plotly.express as px
+import plotly.graph_objects as go
+import seaborn as sns
+from matplotlib.figure import Figure
+
+import cuantiles
+
+# Constructores de gráficos compartidos por el panel (app.py) y el generador de
+# informes (informes.py). Cada función devuelve la figura, o None si no hay
+# datos suficientes; quien la llama decide cómo mostrarla o guardarla.
+# Las figuras de matplotlib se crean con Figure() y no con pyplot para que sean
+# seguras de construir desde hilos y procesos sin estado global.
+
+MARGEN = dict(l=40, r=40, t=60, b=40)
+
+LAYOUT_BARRAS = dict(
+    height=500,
+    margin=MARGEN,
+    yaxis=dict(tickfont=dict(size=12)),
+    xaxis=dict(tickfont=dict(size=12)),
+)
+
+LAYOUT_HISTOGRAMA = dict(
+    height=400,
+    margin=MARGEN,
+    xaxis=dict(tickfont=dict(size=12)),
+    yaxis=dict(tickfont=dict(size=12)),
+    barmode='overlay',
+)
+
+LAYOUT_BOXPLOT = dict(
+    height=500,
+    margin=MARGEN,
+    xaxis=dict(tickangle=45, tickfont=dict(size=12)),
+    yaxis=dict(tickfont=dict(size=12)),
+)
+COLOR_BOXPLOT = '#636efa'
+
+
+# ------------------ Distribuciones (matplotlib) ------------------
+
+def kde_roi(df):
+    if len(df) <= 1:
+        return None
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    sns.kdeplot(df['ROI (%)'], fill=True, label='ROI Bruto (%)', color='skyblue', bw_adjust=0.7, clip=(0, 50), ax=ax)
+    sns.kdeplot(df['Net ROI (%)'], fill=True, label='ROI Neto (%)', color='orange', bw_adjust=0.7, clip=(0, 50), ax=ax)
+    ax.set_title('Distribución de ROI Bruto y Neto')
+    ax.set_xlabel('ROI (%)')
+    ax.set_ylabel('Densidad')
+    ax.set_xlim(0, 50)
+    ax.legend()
+    return fig
+
+
+def kde_rentabilidad(df):
+    if len(df) <= 1:
+        return None
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    sns.kdeplot(df['estimated_revenue_l365d'], fill=True, color='skyblue', bw_adjust=0.7, ax=ax)
+    ax.set_title('Distribución de Rentabilidad Estimada')
+    ax.set_xlabel('Rentabilidad (€)')
+    ax.set_ylabel('Densidad')
+    return fig
+
+
+# ------------------ Rankings por barrio ------------------
+
+def _barras_top(tabla, x, etiqueta, titulo, color_scale=None):
+    if tabla.empty:
+        return None
+    opciones = {}
+    if color_scale is not None:
+        opciones = dict(color=x, color_continuous_scale=color_scale)
+    fig = px.bar(
+        tabla,
+        x=x,
+        y='neighbourhood',
+        orientation='h',
+        labels={x: etiqueta, 'neighbourhood': 'Barrio'},
+        title=titulo,
+        **opciones
+    )
+    if color_scale is not None:
+        fig.update_layout(**LAYOUT_BARRAS)
+    return fig
+
+
+def _top_media(df, columna, n=15):
+    tabla = df.groupby('neighbourhood')[columna].mean().reset_index()
+    return tabla.sort_values(by=columna, ascending=False).head(n)
+
+
+def precio_vivienda_barrio(df_inmobiliario):
+    if df_inmobiliario is None or 'precio' not in df_inmobiliario.columns:
+        return None
+    return _barras_top(
+        _top_media(df_inmobiliario, 'precio'),
+        'precio',
+        'Precio medio m2 de compra (€)',
+        'Top 15 barrios más caros por precio medio m2 de compra',
+    )
+
+
+def precio_m2_barrio(df):
+    if 'price_per_m2_jun2025' not in df.columns:
+        return None
+    return _barras_top(
+        _top_media(df, 'price_per_m2_jun2025'),
+        'price_per_m2_jun2025',
+        'Precio medio €/m²',
+        'Top 15 barrios más caros por precio medio €/m²',
+    )
+
+
+def roi_neto_barrio(df):
+    return _barras_top(_top_media(df, 'Net ROI (%)'), 'Net ROI (%)', 'ROI Neto (%)', 'Top 15 barrios por ROI Neto (%)')
+
+
+def roi_bruto_barrio(df):
+    return _barras_top(_top_media(df, 'ROI (%)'), 'ROI (%)', 'ROI Bruto (%)', 'Top 15 barrios por ROI Bruto (%)')
+
+
+def rentabilidad_barrio(df):
+    if 'estimated_revenue_l365d' not in df.columns:
+        return None
+    return _barras_top(
+        _top_media(df, 'estimated_revenue_l365d'),
+        'estimated_revenue_l365d',
+        'Rentabilidad Estimada (€)',
+        'Top 15 barrios por Rentabilidad Estimada (€)',
+    )
+
+
+def competencia_barrio(df):
+    if 'id' not in df.columns:
+        return None
+    competencia = df.groupby('neighbourhood')['id'].count().reset_index().rename(columns={'id': 'n_anuncios'})
+    return _barras_top(
+        competencia.sort_values(by='n_anuncios', ascending=False).head(15),
+        'n_anuncios',
+        'Nº de anuncios',
+        'Top 15 barrios con más competencia (nº de anuncios)',
+    )
+
+
+def anuncios_activos_barrio(df):
+    # Anuncios activos (>30 días alquilados/año)
+    if 'days_rented' not in df.columns or 'id' not in df.columns:
+        return None
+    activos = df[df['days_rented'] > 30]
+    competencia = activos.groupby('neighbourhood')['id'].count().reset_index().rename(columns={'id': 'n_anuncios_activos'})
+    return _barras_top(
+        competencia.sort_values(by='n_anuncios_activos', ascending=False).head(15),
+        'n_anuncios_activos',
+        'Nº de anuncios activos',
+        'Top 15 barrios con más anuncios activos (>30 días alquilados/año)',
+    )
+
+
+def amenities_barrio(df):
+    if 'n_amenities' not in df.columns:
+        return None
+    return _barras_top(
+        _top_media(df, 'n_amenities'),
+        'n_amenities',
+        'Nº medio de amenities',
+        'Top 15 barrios por número medio de amenities',
+        color_scale='Purples',
+    )
+
+
+def resenas_barrio(df):
+    if 'number_of_reviews' not in df.columns:
+        return None
+    tabla = df.groupby('neighbourhood')['number_of_reviews'].sum().reset_index()
+    return _barras_top(
+        tabla.sort_values(by='number_of_reviews', ascending=False).head(15),
+        'number_of_reviews',
+        'Número total de reseñas',
+        'Top 15 barrios por número total de reseñas',
+        color_scale='Blues',
+    )
+
+
+def habitaciones_barrio(df):
+    if 'bedrooms' not in df.columns or 'bathrooms' not in df.columns:
+        return None
+    tabla = df.groupby('neighbourhood').agg({'bedrooms': 'mean', 'bathrooms': 'mean'}).reset_index()
+    return _barras_top(
+        tabla.sort_values(by='bedrooms', ascending=False).head(15),
+        'bedrooms',
+        'Habitaciones medias',
+        'Top 15 barrios por número medio de habitaciones',
+        color_scale='Teal',
+    )
+
+
+def resumen_distritos(medias_distrito):
+    # Media por distrito (neighbourhood_group) de ROI neto o, si no existe, rentabilidad
+    metrica = 'Net ROI (%)' if 'Net ROI (%)' in medias_distrito.columns else 'estimated_revenue_l365d'
+    if metrica not in medias_distrito.columns or medias_distrito.empty:
+        return None
+    tabla = medias_distrito.sort_values(by=metrica, ascending=False)
+    fig = px.bar(
+        tabla,
+        x=metrica,
+        y='neighbourhood_group',
+        orientation='h',
+        hover_data=['n_anuncios'],
+        labels={metrica: ETIQUETAS_MAPA[metrica], 'neighbourhood_group': 'Distrito', 'n_anuncios': 'Nº de anuncios'},
+        title='Media por distrito'
+    )
+    fig.update_layout(**LAYOUT_BARRAS)
+    return fig
+
+
+# ------------------ Relaciones y distribuciones (plotly) ------------------
+
+def precio_vs_roi(df):
+    if 'price' not in df.columns or 'Net ROI (%)' not in df.columns:
+        return None
+    if 'city' in df.columns and df['city'].str.lower().nunique() == 1 and df['city'].str.lower().iloc[0] == 'valencia':
+        fig = px.scatter(
+            df,
+            x='price',
+            y='Net ROI (%)',
+            color='neighbourhood',
+            hover_data=['neighbourhood'],
+            opacity=0.6,
+            labels={'price': 'Precio alquiler (€)', 'Net ROI (%)': 'ROI Neto (%)', 'neighbourhood': 'Barrio'},
+            title='Relación entre precio de alquiler y ROI neto por barrio (Valencia)'
+        )
+        fig.update_traces(marker=dict(size=10, line=dict(width=1, color='DarkSlateGrey')))
+        fig.update_layout(legend_title_text='Barrio', showlegend=False, height=500, margin=MARGEN)
+        return fig
+    df_barrio = df.groupby('neighbourhood').agg({'price': 'mean', 'Net ROI (%)': 'mean'}).reset_index()
+    if df_barrio.empty:
+        return None
+    fig = px.scatter(
+        df_barrio,
+        x='price',
+        y='Net ROI (%)',
+        text='neighbourhood',
+        labels={'price': 'Precio medio alquiler (€)', 'Net ROI (%)': 'ROI Neto (%)'},
+        title='Precio medio de alquiler vs ROI Neto por barrio'
+    )
+    fig.update_traces(marker=dict(size=12, color='royalblue', line=dict(width=1, color='DarkSlateGrey')))
+    fig.update_layout(height=500, margin=MARGEN)
+    return fig
+
+
+def precio_vs_rentabilidad(df):
+    if 'price' not in df.columns or 'estimated_revenue_l365d' not in df.columns:
+        return None
+    return px.scatter(
+        df,
+        x='price',
+        y='estimated_revenue_l365d',
+        color='neighbourhood',
+        hover_data=['neighbourhood'],
+        labels={'price': 'Precio alquiler (€)', 'estimated_revenue_l365d': 'Rentabilidad Estimada (€)', 'neighbourhood': 'Barrio'},
+        title='Relación entre precio de alquiler y rentabilidad estimada por barrio (Madrid)'
+    )
+
+
+def rentabilidad_por(df, columna, etiqueta, titulo):
+    # Rentabilidad media por número de habitaciones, baños...
+    if columna not in df.columns or 'estimated_revenue_l365d' not in df.columns:
+        return None
+    tabla = df.groupby(columna)['estimated_revenue_l365d'].mean().reset_index()
+    return px.bar(
+        tabla,
+        x=columna,
+        y='estimated_revenue_l365d',
+        labels={columna: etiqueta, 'estimated_revenue_l365d': 'Rentabilidad Estimada (€)'},
+        title=titulo
+    )
+
+
+def histograma(df, columna, etiqueta, titulo):
+    if columna not in df.columns:
+        return None
+    fig = px.histogram(
+        df, x=columna, nbins=40, color='neighbourhood',
+        labels={columna: etiqueta},
+        title=titulo,
+        opacity=0.7
+    )
+    fig.update_layout(**LAYOUT_HISTOGRAMA)
+    return fig
+
+
+def boxplot_top(datos_ciudad, barrios, columna, etiqueta, titulo):
+    # Boxplot por barrio, solo para los 15 barrios con más anuncios. Las cajas
+    # salen de los resúmenes precalculados (cuantiles.py), no de los anuncios.
+    sketches = datos_ciudad.get('sketches', {})
+    if columna not in sketches:
+        return None
+    n_anuncios = datos_ciudad['agregados']['n_anuncios']
+    top_barrios = n_anuncios[n_anuncios.index.isin(barrios)].nlargest(15).index
+    resumenes = cuantiles.resumenes_barrios(sketches, columna, top_barrios)
+    if resumenes.empty:
+        return None
+    fig = go.Figure(go.Box(
+        x=resumenes['neighbourhood'], q1=resumenes['q1'], median=resumenes['mediana'], q3=resumenes['q3'],
+        lowerfence=resumenes['bigote_bajo'], upperfence=resumenes['bigote_alto'], name=etiqueta,
+        marker_color=COLOR_BOXPLOT,
+    ))
+    outliers = resumenes[['neighbourhood', 'outliers']].explode('outliers').dropna()
+    fig.add_trace(go.Scatter(
+        x=outliers['neighbourhood'], y=outliers['outliers'], mode='markers', name='Outliers',
+        marker=dict(size=4, color=COLOR_BOXPLOT),
+    ))
+    fig.update_layout(title=titulo, xaxis_title='Barrio', yaxis_title=etiqueta, showlegend=False)
+    fig.update_layout(**LAYOUT_BOXPLOT)
+    return fig
+
+
+# ------------------ Delincuencia (matplotlib) ------------------
+
+def _delitos(df_delincuencia):
+    if df_delincuencia is None or df_delincuencia.empty:
+        return None
+    return df_delincuencia[df_delincuencia['Parámetro'] != 'Total']
+
+
+def delitos_por_ano(df_delincuencia):
+    df_filtrado = _delitos(df_delincuencia)
+    if df_filtrado is None:
+        return None
+    fig = Figure(figsize=(14, 7))
+    ax = fig.subplots()
+    sns.barplot(data=df_filtrado, x='Año', y='Denuncias', hue='Parámetro', ax=ax)
+    ax.set_title('Delitos denunciados en Valencia por año')
+    ax.set_ylabel('Número de denuncias')
+    ax.set_xlabel('Año')
+    ax.legend(title='Tipo de delito', bbox_to_anchor=(1.05, 1), loc='upper left')
+    fig.tight_layout()
+    return fig
+
+
+def delitos_heatmap(df_delincuencia):
+    df_filtrado = _delitos(df_delincuencia)
+    if df_filtrado is None:
+        return None
+    fig = Figure(figsize=(14, 7))
+    ax = fig.subplots()
+    heatmap_data = df_filtrado.pivot_table(index='Parámetro', columns='Año', values='Denuncias', aggfunc='sum').fillna(0)
+    sns.heatmap(
+        heatmap_data,
+        cmap='YlOrRd',
+        annot=True,
+        fmt='.0f',
+        linewidths=.5,
+        cbar_kws={'label': 'Número de denuncias'},
+        annot_kws={"size": 10},
+        ax=ax
+    )
+    ax.set_title('Mapa de calor de delitos denunciados en Valencia por tipo y año')
+    ax.set_xlabel('Año')
+    ax.set_ylabel('Tipo de delito')
+    ax.tick_params(axis='x', rotation=45)
+    fig.tight_layout()
+    return fig
+
+
+# ------------------ Mapas y evolución ------------------
+
+ETIQUETAS_MAPA = {'Net ROI (%)': 'ROI Neto (%)', 'estimated_revenue_l365d': 'Rentabilidad Estimada (€)', 'neighbourhood': 'Barrio'}
+
+
+def mapa_barrios(medias_barrio, geojson, centro, zoom):
+    # Coropletas de la media por barrio (ROI neto o, si no existe, rentabilidad)
+    if geojson is None or medias_barrio.empty:
+        return None
+    metrica = 'Net ROI (%)' if 'Net ROI (%)' in medias_barrio.columns else 'estimated_revenue_l365d'
+    if metrica not in medias_barrio.columns:
+        return None
+    fig = px.choropleth_map(
+        medias_barrio,
+        geojson=geojson,
+        locations='neighbourhood',
+        featureidkey='id',
+        color=metrica,
+        color_continuous_scale='Viridis',
+        center=centro,
+        zoom=zoom,
+        opacity=0.6,
+        labels=ETIQUETAS_MAPA,
+        title='Media por barrio'
+    )
+    fig.update_layout(height=550, margin=dict(l=0, r=0, t=40, b=0))
+    return fig
+
+
+def tendencia_barrios(df_tendencia, metrica, etiqueta):
+    if metrica not in df_tendencia.columns or df_tendencia.empty:
+        return None
+    return px.line(
+        df_tendencia,
+        x='fecha',
+        y=metrica,
+        color='neighbourhood',
+        markers=True,
+        labels={'fecha': 'Fecha del snapshot', metrica: etiqueta, 'neighbourhood': 'Barrio'},
+        title=f'Evolución de {etiqueta.lower()} por barrio'
+    )
+
+
+# ------------------ Secciones por ciudad ------------------
+
+def secciones_ciudad(ciudad, df, datos_ciudad):
+    # Lista ordenada de (pestaña, título, constructor, depende_de_barrios) con
+    # los gráficos de cada ciudad. Los que no dependen de los barrios
+    # seleccionados (vivienda, delincuencia) se pueden reutilizar entre informes.
+    inmobiliario = datos_ciudad.get('inmobiliario')
+    delincuencia = datos_ciudad.get('delincuencia')
+    barrios = df['neighbourhood'].unique() if 'neighbourhood' in df.columns else []
+    if ciudad == 'valencia':
+        return [
+            ("Resumen General", "Distribución de ROI Bruto y Neto (%)", lambda: kde_roi(df), True),
+            ("Precios de Vivienda", "Precios de Vivienda por Barrio", lambda: precio_vivienda_barrio(inmobiliario), False),
+            ("Rentabilidad por Barrio", "ROI Neto por barrio", lambda: roi_neto_barrio(df), True),
+            ("Rentabilidad por Barrio", "ROI Bruto por barrio", lambda: roi_bruto_barrio(df), True),
+            ("Competencia y Demanda", "Competencia por barrio", lambda: competencia_barrio(df), True),
+            ("Competencia y Demanda", "Anuncios activos por barrio", lambda: anuncios_activos_barrio(df), True),
+            ("Análisis Avanzado", "Relación entre precio medio de alquiler y ROI neto por barrio", lambda: precio_vs_roi(df), True),
+            ("Análisis Avanzado", "Top 15 barrios por número medio de amenities", lambda: amenities_barrio(df), True),
+            ("Análisis Avanzado", "Top 15 barrios por número total de reseñas", lambda: resenas_barrio(df), True),
+            ("Análisis Avanzado", "Top 15 barrios por número medio de habitaciones y baños", lambda: habitaciones_barrio(df), True),
+            ("Análisis Avanzado", "Histograma de precios de alquiler",
+             lambda: histograma(df, 'price', 'Precio alquiler (€)', 'Distribución de precios de alquiler por barrio'), True),
+            ("Análisis Avanzado", "Boxplot de precios de alquiler por barrio (Top 15)",
+             lambda: boxplot_top(datos_ciudad, barrios, 'price', 'Precio alquiler (€)', 'Boxplot de precios de alquiler por barrio (Top 15)'), True),
+            ("Análisis Avanzado", "Histograma de ROI Neto (%)",
+             lambda: histograma(df, 'Net ROI (%)', 'ROI Neto (%)', 'Distribución de ROI Neto por barrio'), True),
+            ("Análisis Avanzado", "Boxplot de ROI Neto por barrio (Top 15)",
+             lambda: boxplot_top(datos_ciudad, barrios, 'Net ROI (%)', 'ROI Neto (%)', 'Boxplot de ROI Neto por barrio (Top 15)'), True),
+            ("Análisis Avanzado", "Histograma de días alquilados",
+             lambda: histograma(df, 'days_rented', 'Días alquilados', 'Distribución de días alquilados por barrio'), True),
+            ("Análisis Avanzado", "Boxplot de días alquilados por barrio (Top 15)",
+             lambda: boxplot_top(datos_ciudad, barrios, 'days_rented', 'Días alquilados', 'Boxplot de días alquilados por barrio (Top 15)'), True),
+            ("Análisis Avanzado", "Delitos denunciados en Valencia por año", lambda: delitos_por_ano(delincuencia), False),
+            ("Análisis Avanzado", "Mapa de calor de delitos denunciados en Valencia por tipo y año",
+             lambda: delitos_heatmap(delincuencia), False),
+        ]
+    if ciudad == 'madrid':
+        return [
+            ("Madrid General", "Distribución de Rentabilidad Estimada (€ / año)", lambda: kde_rentabilidad(df), True),
+            ("Madrid de Vivienda", "Precios de Vivienda por Barrio en Madrid", lambda: precio_m2_barrio(df), True),
+            ("Rentabilidad por Barrio", "Rentabilidad por Barrio en Madrid", lambda: rentabilidad_barrio(df), True),
+            ("Competencia y Demanda", "Competencia por barrio", lambda: competencia_barrio(df), True),
+            ("Competencia y Demanda", "Anuncios activos por barrio", lambda: anuncios_activos_barrio(df), True),
+            ("Análisis Avanzado", "Relación entre precio medio de alquiler y rentabilidad estimada por barrio",
+             lambda: precio_vs_rentabilidad(df), True),
+            ("Análisis Avanzado", "Rentabilidad media por número de habitaciones",
+             lambda: rentabilidad_por(df, 'bedrooms', 'Número de habitaciones', 'Rentabilidad media por número de habitaciones'), True),
+            ("Análisis Avanzado", "Rentabilidad media por número de baños",
+             lambda: rentabilidad_por(df, 'bathrooms', 'Número de baños', 'Rentabilidad media por número de baños'), True),
+        ]
+    # Barcelona y Málaga aún no tienen pestañas propias en el panel: informe genérico
+    return [
+        ("Rentabilidad por Barrio", "Rentabilidad por barrio", lambda: rentabilidad_barrio(df), True),
+        ("Competencia y Demanda", "Competencia por barrio", lambda: competencia_barrio(df), True),
+        ("Competencia y Demanda", "Anuncios activos por barrio", lambda: anuncios_activos_barrio(df), True),
+    ]
@@ -0,0 +1,100 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import datos
+
+# Histórico de snapshots por ciudad, particionado por fecha de scrape:
+#   data/historico/<ciudad>/cambios/fecha=<AAAA-MM-DD>/part.parquet   filas nuevas o cambiadas
+#   data/historico/<ciudad>/quitados/fecha=<AAAA-MM-DD>/part.parquet  ids que desaparecen
+#   data/historico/<ciudad>/barrios/fecha=<AAAA-MM-DD>/part.parquet   métricas por barrio
+# El primer snapshot guarda todos los anuncios; los siguientes solo las diferencias.
+HISTORICO_DIR = os.path.join(datos.DATA_DIR, "historico")
+
+# Nombres estables en el histórico para columnas que llevan la fecha en el nombre
+ALIAS_COLUMNAS = {"price_per_m2_jun2025": "price_per_m2"}
+
+_PARTICIONADO = ds.partitioning(pa.schema([("fecha", pa.string())]), flavor="hive")
+
+
+def _ruta(ciudad, tabla, fecha=None, base_dir=HISTORICO_DIR):
+    ruta = os.path.join(base_dir, ciudad.lower(), tabla)
+    if fecha is not None:
+        ruta = os.path.join(ruta, f"fecha={fecha}")
+    return ruta
+
+
+def _escribir(df, ciudad, tabla, fecha, base_dir):
+    df = df.rename(columns=ALIAS_COLUMNAS)
+    # Las columnas de texto se guardan como string para que Arrow no falle con tipos mezclados
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].astype("string")
+    ruta = _ruta(ciudad, tabla, fecha, base_dir)
+    tmp = ruta + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), os.path.join(tmp, "part.parquet"))
+    # Renombrado final para que una lectura concurrente no vea la partición a medias
+    shutil.rmtree(ruta, ignore_errors=True)
+    os.replace(tmp, ruta)
+
+
+def metricas_barrio(agregados):
+    df = datos.medias(agregados).rename(columns=ALIAS_COLUMNAS)
+    return df.rename_axis("neighbourhood").reset_index()
+
+
+def fechas(ciudad, base_dir=HISTORICO_DIR):
+    ruta = _ruta(ciudad, "barrios", base_dir=base_dir)
+    if not os.path.isdir(ruta):
+        return []
+    return sorted(d.split("=", 1)[1] for d in os.listdir(ruta) if d.startswith("fecha=") and not d.endswith(".tmp"))
+
+
+def guardar_snapshot(ciudad, fecha, cambiados, quitados, agregados, base_dir=HISTORICO_DIR):
+    # Guarda las diferencias del snapshot y sus métricas por barrio ya agregadas
+    columnas = [c for c in cambiados.columns if c not in datos.COLUMNAS_DERIVADAS]
+    _escribir(cambiados[columnas], ciudad, "cambios", fecha, base_dir)
+    # id siempre como int64: con una lista vacía (la base) pandas lo crearía
+    # como double y Arrow tomaría ese esquema para todo el dataset, que no
+    # admite los ids de Inside Airbnb por encima de 2**53
+    _escribir(pd.DataFrame({"id": np.asarray(quitados, dtype="int64")}), ciudad, "quitados", fecha, base_dir)
+    _escribir(metricas_barrio(agregados), ciudad, "barrios", fecha, base_dir)
+
+
+def guardar_base(ciudad, fecha, datos_ciudad, base_dir=HISTORICO_DIR):
+    # Primer snapshot del histórico: todos los anuncios cargados actualmente
+    guardar_snapshot(ciudad, fecha, datos_ciudad["listings"], [], datos_ciudad["agregados"], base_dir)
+
+
+def _dataset(ciudad, tabla, base_dir):
+    return ds.dataset(_ruta(ciudad, tabla, base_dir=base_dir), format="parquet", partitioning=_PARTICIONADO)
+
+
+def tendencias(ciudad, metricas, barrios=None, desde=None, hasta=None, base_dir=HISTORICO_DIR):
+    # Serie temporal de métricas por barrio. Solo lee la tabla de agregados, las
+    # columnas pedidas y las particiones de fecha dentro del rango.
+    if not fechas(ciudad, base_dir):
+        return pd.DataFrame(columns=["fecha", "neighbourhood", *metricas])
+    filtro = None
+    condiciones = []
+    if barrios is not None:
+        condiciones.append(ds.field("neighbourhood").isin(list(barrios)))
+    if desde is not None:
+        condiciones.append(ds.field("fecha") >= desde)
+    if hasta is not None:
+        condiciones.append(ds.field("fecha") <= hasta)
+    for condicion in condiciones:
+        filtro = condicion if filtro is None else filtro & condicion
+    dataset = _dataset(ciudad, "barrios", base_dir)
+    metricas = [ALIAS_COLUMNAS.get(m, m) for m in metricas]
+    metricas = [m for m in metricas if m in dataset.schema.names]
+    tabla = dataset.to_table(columns=["fecha", "neighbourhood", *metricas], filter=filtro)
+    return tabla.to_pandas().sort_values(["neighbourhood", "fecha"], ignore_index=True)
+
@@ -0,0 +1,196 @@
+# Genera informes estáticos (HTML y, opcionalmente, PDF) por ciudad y por distrito.
+#
+# Uso, desde la raíz del repositorio:
+#
+#     python app/informes.py --salida informes --procesos 8
+#     python app/informes.py --ciudades valencia madrid --pdf
+#
+# Los gráficos son los mismos que muestra el panel (graficos.py). Los que no
+# dependen del distrito (precios de vivienda, delincuencia) se renderizan una
+# sola vez por ciudad y se reutilizan en todos sus informes.
+import argparse
+import base64
+import html
+import importlib.util
+import io
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.image as mpimg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+from plotly.offline import get_plotlyjs_version
+
+import datos
+import graficos
+
+CIUDADES = ['valencia', 'malaga', 'madrid', 'barcelona']
+
+PLANTILLA = """<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>{titulo}</title>
+<script src="https://cdn.plot.ly/plotly-{version_plotly}.min.js"></script>
+<style>
+body {{ font-family: sans-serif; max-width: 1100px; margin: 2em auto; }}
+h2 {{ border-bottom: 1px solid #ccc; padding-bottom: .2em; }}
+img {{ max-width: 100%; }}
+</style>
+</head>
+<body>
+<h1>{titulo}</h1>
+<p>{resumen}</p>
+{cuerpo}
+</body>
+</html>
+"""
+
+
+def _slug(texto):
+    return re.sub(r'[^a-z0-9]+', '_', texto.lower()).strip('_')
+
+
+def renderizar(fig, pdf=False):
+    # Convierte una figura en un fragmento HTML y, si hace falta, en PNG para el PDF
+    if isinstance(fig, Figure):
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=100, bbox_inches='tight')
+        png = buffer.getvalue()
+        fragmento = f'<img src="data:image/png;base64,{base64.b64encode(png).decode()}">'
+        return {'html': fragmento, 'png': png}
+    fragmento = fig.to_html(full_html=False, include_plotlyjs=False)
+    return {'html': fragmento, 'png': fig.to_image(format='png', scale=2) if pdf else None}
+
+
+def _datos_grupo(datos_ciudad, grupo):
+    df = datos_ciudad['listings']
+    if grupo is None:
+        return df
+    return df[df['neighbourhood_group'] == grupo]
+
+
+def fragmentos_comunes(ciudad, pdf=False):
+    # Renderiza una vez por ciudad los gráficos que no dependen del distrito
+    datos_ciudad = datos.cargar_ciudad(ciudad)
+    comunes = {}
+    for _, titulo, construir, depende_de_barrios in graficos.secciones_ciudad(ciudad, datos_ciudad['listings'], datos_ciudad):
+        if not depende_de_barrios:
+            fig = construir()
+            comunes[titulo] = None if fig is None else renderizar(fig, pdf)
+    return ciudad, comunes
+
+
+def generar_informe(ciudad, grupo, comunes, salida, pdf=False):
+    inicio = time.perf_counter()
+    datos_ciudad = datos.cargar_ciudad(ciudad)
+    df = _datos_grupo(datos_ciudad, grupo)
+    nombre = ciudad.capitalize() if grupo is None else f"{ciudad.capitalize()} - {grupo}"
+
+    secciones = []
+    for pestana, titulo, construir, depende_de_barrios in graficos.secciones_ciudad(ciudad, df, datos_ciudad):
+        if depende_de_barrios:
+            fig = construir()
+            renderizado = None if fig is None else renderizar(fig, pdf)
+        else:
+            renderizado = comunes.get(titulo)
+        if renderizado is not None:
+            secciones.append((pestana, titulo, renderizado))
+
+    resumen = f"Nº de anuncios: {len(df)}"
+    if 'Net ROI (%)' in df.columns:
+        resumen += f" · ROI Neto medio (%): {df['Net ROI (%)'].mean():.2f}"
+    if 'estimated_revenue_l365d' in df.columns:
+        resumen += f" · Rentabilidad media (€): {df['estimated_revenue_l365d'].mean():.2f}"
+
+    cuerpo = []
+    pestana_actual = None
+    for pestana, titulo, renderizado in secciones:
+        if pestana != pestana_actual:
+            cuerpo.append(f"<h2>{html.escape(pestana)}</h2>")
+            pestana_actual = pestana
+        cuerpo.append(f"<h3>{html.escape(titulo)}</h3>\n{renderizado['html']}")
+
+    carpeta = os.path.join(salida, ciudad)
+    os.makedirs(carpeta, exist_ok=True)
+    base = os.path.join(carpeta, ciudad if grupo is None else _slug(grupo))
+    with open(base + '.html', 'w', encoding='utf-8') as f:
+        f.write(PLANTILLA.format(
+            titulo=html.escape(f"Informe de inversión: {nombre}"),
+            version_plotly=get_plotlyjs_version(),
+            resumen=html.escape(resumen),
+            cuerpo='\n'.join(cuerpo),
+        ))
+
+    if pdf:
+        with PdfPages(base + '.pdf') as documento:
+            for _, titulo, renderizado in secciones:
+                pagina = Figure(figsize=(11.69, 8.27))
+                ax = pagina.subplots()
+                ax.imshow(mpimg.imread(io.BytesIO(renderizado['png']), format='png'))
+                ax.set_title(titulo)
+                ax.axis('off')
+                documento.savefig(pagina)
+
+    return base, time.perf_counter() - inicio
+
+
+def grupos_ciudad(ciudad):
+    df = datos.cargar_ciudad(ciudad)['listings']
+    if 'neighbourhood_group' not in df.columns:
+        return ciudad, []
+    return ciudad, sorted(df['neighbourhood_group'].dropna().unique())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera informes de inversión por ciudad y distrito.")
+    parser.add_argument('--ciudades', nargs='+', default=CIUDADES, choices=CIUDADES)
+    parser.add_argument('--salida', default='informes')
+    parser.add_argument('--procesos', type=int, default=os.cpu_count())
+    parser.add_argument('--pdf', action='store_true', help="genera también PDF (requiere kaleido)")
+    args = parser.parse_args(argv)
+    if args.pdf and importlib.util.find_spec('kaleido') is None:
+        parser.error("--pdf necesita el paquete kaleido para exportar los gráficos de plotly")
+
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.procesos) as pool:
+        # Fase 1: gráficos comunes por ciudad y lista de distritos
+        fase1 = {
+            ciudad: (pool.submit(fragmentos_comunes, ciudad, args.pdf), pool.submit(grupos_ciudad, ciudad))
+            for ciudad in args.ciudades
+        }
+        comunes, grupos = {}, {}
+        for ciudad, (futuro_comunes, futuro_grupos) in fase1.items():
+            try:
+                # Las dos a la vez: una ciudad sin alguna de ellas no pasa a la fase 2
+                fragmentos, distritos = futuro_comunes.result()[1], futuro_grupos.result()[1]
+            except Exception as e:
+                print(f"{ciudad}: no se pudieron cargar los datos ({e})")
+                continue
+            comunes[ciudad], grupos[ciudad] = fragmentos, distritos
+
+        # Fase 2: un informe por ciudad y uno por distrito, en paralelo
+        futuros = {
+            pool.submit(generar_informe, ciudad, grupo, comunes[ciudad], args.salida, args.pdf): (ciudad, grupo)
+            for ciudad in comunes
+            for grupo in [None, *grupos[ciudad]]
+        }
+        fallidos = 0
+        for futuro, (ciudad, grupo) in futuros.items():
+            try:
+                base, segundos = futuro.result()
+            except Exception as e:
+                # Un informe que falla no impide recoger el resto
+                fallidos += 1
+                print(f"{ciudad}{f' / {grupo}' if grupo else ''}: no se pudo generar el informe ({e})")
+                continue
+            print(f"{base}: {segundos:.1f} s")
+
+    resumen = f"{len(futuros) - fallidos} informes en {time.perf_counter() - inicio:.1f} s"
+    print(resumen + (f" ({fallidos} con error)" if fallidos else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import io
+import logging
+import threading
+import time
+
+from matplotlib.figure import Figure
+
+import actualizacion
+import datos
+import graficos
+
+# Precarga en segundo plano: al arrancar el proceso carga todas las ciudades y
+# calcula las figuras de la vista por defecto (todos los barrios). Después
+# revisa periódicamente cada ciudad y la renueva antes de que caduque su TTL o
+# en cuanto llega un snapshot nuevo, sin que ninguna sesión tenga que esperar:
+# hasta que la nueva versión está lista se sigue sirviendo la anterior.
+
+# Cada cuánto revisa el hilo si hay algo que renovar (segundos)
+INTERVALO = actualizacion.INTERVALO_COMPROBACION
+
+# Antelación con la que se renueva una ciudad antes de que caduque su TTL
+ANTELACION = 5 * INTERVALO
+
+logger = logging.getLogger(__name__)
+
+_figuras = {}   # ciudad -> (generacion, {titulo: figura})
+_estado = {}    # ciudad -> "pendiente", "lista" o el error de la última carga
+_lock = threading.Lock()
+_hilo = None
+
+
+def _png(fig):
+    # Las figuras de matplotlib se comparten ya renderizadas: un mismo Figure
+    # no se puede dibujar a la vez desde varias sesiones
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=100, bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def figuras_por_defecto(ciudad, datos_ciudad):
+    # Las mismas secciones que el panel y los informes, con todos los barrios
+    figuras = {}
+    for _, titulo, construir, _ in graficos.secciones_ciudad(ciudad, datos_ciudad["listings"], datos_ciudad):
+        try:
+            fig = construir()
+        except Exception:
+            logger.exception("%s: no se pudo precalcular «%s»", ciudad, titulo)
+            continue
+        figuras[titulo] = _png(fig) if isinstance(fig, Figure) else fig
+    return figuras
+
+
+def calentar(ciudad, data_dir=datos.DATA_DIR, figuras=True):
+    # Los snapshots solo se aplican sobre una ciudad ya cargada: si su carga
+    # falló, refrescar fallaría por lo mismo
+    restante = datos.caduca_en(ciudad)
+    if restante is not None:
+        try:
+            actualizacion.refrescar(ciudad, data_dir)
+        except Exception:
+            logger.exception("%s: no se pudo aplicar el último snapshot", ciudad)
+        restante = datos.caduca_en(ciudad)
+
+    if restante is not None and restante < ANTELACION:
+        datos_ciudad = datos.recargar(ciudad, data_dir)
+    else:
+        datos_ciudad = datos.cargar_ciudad(ciudad, data_dir)
+
+    entrada = _figuras.get(ciudad)
+    if figuras and (entrada is None or entrada[0] != datos_ciudad["generacion"]):
+        inicio = time.perf_counter()
+        _figuras[ciudad] = (datos_ciudad["generacion"], figuras_por_defecto(ciudad, datos_ciudad))
+        logger.info("%s: figuras por defecto en %.2f s", ciudad, time.perf_counter() - inicio)
+
+
+def _bucle(ciudades, data_dir, figuras):
+    # Primera pasada: todas las ciudades en paralelo
+    for ciudad, resultado in datos.cargar_ciudades(ciudades, data_dir).items():
+        if isinstance(resultado, Exception):
+            logger.error("%s: no se pudieron cargar los datos (%s)", ciudad, resultado)
+            _estado[ciudad] = str(resultado)
+    while True:
+        for ciudad in ciudades:
+            try:
+                calentar(ciudad, data_dir, figuras)
+                _estado[ciudad] = "lista"
+            except Exception as e:
+                # Una línea, y solo cuando cambia el error: la ciudad se
+                # reintenta en cada vuelta y el error ya queda en _estado
+                if _estado.get(ciudad) != str(e):
+                    logger.error("%s: no se pudieron cargar los datos (%s)", ciudad, e)
+                _estado[ciudad] = str(e)
+        time.sleep(INTERVALO)
+
+
+def iniciar(ciudades, data_dir=datos.DATA_DIR, figuras=True):
+    # Arranca el hilo una sola vez por proceso; las llamadas siguientes no hacen nada
+    global _hilo
+    with _lock:
+        if _hilo is not None:
+            return
+        ciudades = [c.lower() for c in ciudades]
+        for ciudad in ciudades:
+            _estado.setdefault(ciudad, "pendiente")
+        _hilo = threading.Thread(target=_bucle, args=(ciudades, data_dir, figuras), name="precarga", daemon=True)
+        _hilo.start()
+
+
+def en_marcha():
+    return _hilo is not None and _hilo.is_alive()
+
+
+def lista():
+    # True solo cuando todas las ciudades están cargadas; una ciudad con error
+    # no cuenta como lista (ver errores())
+    return bool(_estado) and all(e == "lista" for e in _estado.values())
+
+
+def errores():
+    # {ciudad: error} de las ciudades cuya última precarga falló
+    return {ciudad: e for ciudad, e in _estado.items() if e not in ("pendiente", "lista")}
+
+
+def estado():
+    return dict(_estado)
+
+
+def figura(ciudad, datos_ciudad, titulo, df, construir):
+    # Figura precalculada si la vista es la de por defecto (df es el DataFrame
+    # compartido, o None si el gráfico no depende de los barrios) y corresponde
+    # a la versión actual de los datos; si no, se construye en el momento.
+    entrada = _figuras.get(ciudad)
+    if (
+        entrada is not None
+        and entrada[0] == datos_ciudad["generacion"]
+        and titulo in entrada[1]
+        and (df is None or df is datos_ciudad["listings"])
+    ):
+        return entrada[1][titulo]
+    return construir()